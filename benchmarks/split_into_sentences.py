@@ -0,0 +1,166 @@
+"""Regression corpus and benchmark for `utils.wiki.split_into_sentences`.
+
+Checks that the single-pass splitter returns exactly what the original
+substitution-pass splitter returned, on the corpus and on random texts
+built from the tokens its rules are about, then times both on a long article.
+
+    python -m benchmarks.split_into_sentences [--fuzz N] [--article-size CHARS]
+"""
+
+import argparse
+import random
+import re
+import timeit
+
+from utils.wiki import split_into_sentences
+
+CORPUS = [
+    "",
+    "   ",
+    "Hello world",
+    "Hello world.",
+    "Hello world. How are you? I am fine!",
+    "Python is a high-level, general-purpose programming language. Its design philosophy emphasizes code "
+    "readability with the use of significant indentation.\nPython is dynamically typed and garbage-collected.",
+    "Mr. Smith bought cheapsite.com for 1.5 million dollars, i.e. he paid a lot for it. Did he mind? Adam Jones "
+    "Jr. thinks he didn't. In any case, this isn't true... Well, with a probability of .9 it isn't.",
+    "Martin Luther King Jr. was an American Baptist minister. He was a leader of the civil rights movement.",
+    "The U.S. Army was founded in 1775. The U.S.A. declared independence a year later.",
+    "Washington, D.C. is the capital of the U.S. He lived there for years.",
+    "J. R. R. Tolkien wrote The Hobbit. It was published in 1937.",
+    "She earned a Ph.D. in physics from MIT. Her thesis was on quantum optics.",
+    "Apple Inc. is an American company. It was founded by Steve Jobs, Steve Wozniak and Ronald Wayne.",
+    "Acme Co. They make anvils. Acme Ltd. sells them in the U.K. and elsewhere.",
+    "Dr. Jekyll and Mr. Hyde was written by Robert Louis Stevenson. Mrs. Ms. and St. are prefixes too.",
+    "The meeting is at 10 a.m. tomorrow. Bring your notes, e.g. the ones from last week.",
+    "Visit wikipedia.org or python.org for more. The site example.io is down.",
+    "Version 3.12.1 was released on 07.12.2023. The server runs at 192.168.0.1 on port 80.",
+    'He said, "This is the end." Then he left.',
+    "She replied, “I will stay.” Nobody answered.",
+    'Is it true?" he asked. "Yes!" she said.',
+    "Wait... what? That can't be right..",
+    "The results were mixed.. Some improved, some did not.",
+    "Prof. Xavier founded the school. Capt. Kirk and Lt. Uhura served on the Enterprise.",
+    "Elizabeth II (Elizabeth Alexandra Mary; 21 April 1926 \u2013 8 September 2022) was Queen of the United Kingdom "
+    "and other Commonwealth realms from 6 February 1952 until her death in 2022.",
+    "The F.B.I. investigated the case. However the N.A.S.A. report was inconclusive. This was in 1969.",
+    "Albert Einstein (14 March 1879 \u2013 18 April 1955) was a German-born theoretical physicist. Einstein is "
+    "widely held as one of the most influential scientists.\n\nBest known for developing the theory of "
+    "relativity, Einstein also made important contributions to quantum mechanics.",
+    "Pi is approximately 3.14159. The number e is approximately 2.71828. They are both irrational.",
+    "The A.B. They said no. X.Y.Z. We agreed.",
+    "Ends with an initial J.",
+    "Multiple\tspaces\xa0and\xa0non-breaking spaces. Tab\tseparated. A.\tB. C.",
+]
+
+FUZZ_TOKENS = [
+    *("Mr.", "Mrs.", "Ms.", "Dr.", "St.", "Prof.", "Capt.", "Lt.", "Ph.D.", "Ph.D"),
+    *("U.S.", "U.S.A.", "D.C.", "N.A.S.A.", "e.g.", "i.e.", "a.m.", "x.A.B.", "A.B."),
+    *("Inc.", "Ltd.", "Jr.", "Sr.", "Co.", "Co.X.", "J.", "x.", "A.", "Mr..", "..com"),
+    *("He", "She", "It", "They", "Their", "Our", "We", "But", "However", "That", "This", "Wherever"),
+    *("the", "cat", "is", "word.", "Word.", "end.", "approx.", "vs.", "No.", "me", "com"),
+    *("1.5", "3.12.1", "192.168.0.1", "12.05.2020", "example.com", "site.org", "www.bbc.co.uk", "a.b.com"),
+    *("...", "..", "?", "!", ".", '"', '."', ".”", "”", "'", '?"', '!"', '?."', '?!"'),
+]
+FUZZ_SEPARATORS = [" ", " ", " ", " ", "", "\n", "\t", "\xa0"]
+
+
+# The original implementation, kept as the reference output
+def legacy_split_into_sentences(text: str) -> list[str]:
+    """Split the text into sentences with the original substitution passes."""
+    alphabets = "([A-Za-z])"
+    prefixes = "(Mr|St|Mrs|Ms|Dr)[.]"
+    suffixes = "(Inc|Ltd|Jr|Sr|Co)"
+    starters = (
+        r"(Mr|Mrs|Ms|Dr|Prof|Capt|Cpt|Lt|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s"
+        r"|This\s|Wherever)"
+    )
+    acronyms = "([A-Z][.][A-Z][.](?:[A-Z][.])?)"
+    websites = "[.](com|net|org|io|gov|edu|me)"
+    digits = "([0-9])"
+    multiple_dots = r"\.{2,}"
+
+    text = " " + text + "  "
+    text = text.replace("\n", " ")
+    text = re.sub(prefixes, "\\1<prd>", text)
+    text = re.sub(websites, "<prd>\\1", text)
+    text = re.sub(digits + "[.]" + digits, "\\1<prd>\\2", text)
+    text = re.sub(multiple_dots, lambda match: "<prd>" * len(match.group(0)) + "<stop>", text)
+    if "Ph.D" in text:
+        text = text.replace("Ph.D.", "Ph<prd>D<prd>")
+    text = re.sub(r"\s" + alphabets + "[.] ", " \\1<prd> ", text)
+    text = re.sub(acronyms + " " + starters, "\\1<stop> \\2", text)
+    text = re.sub(
+        alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]",
+        "\\1<prd>\\2<prd>\\3<prd>",
+        text,
+    )
+    text = re.sub(alphabets + "[.]" + alphabets + "[.]", "\\1<prd>\\2<prd>", text)
+    text = re.sub(" " + suffixes + "[.] " + starters, " \\1<stop> \\2", text)
+    text = re.sub(" " + suffixes + "[.]", " \\1<prd>", text)
+    text = re.sub(" " + alphabets + "[.]", " \\1<prd>", text)
+    if "”" in text:
+        text = text.replace(".”", "”.")
+    if '"' in text:
+        text = text.replace('."', '".')
+    if "!" in text:
+        text = text.replace('!"', '"!')
+    if "?" in text:
+        text = text.replace('?"', '"?')
+    text = text.replace(".", ".<stop>")
+    text = text.replace("?", "?<stop>")
+    text = text.replace("!", "!<stop>")
+    text = text.replace("<prd>", ".")
+    sentences = text.split("<stop>")
+    sentences = [s.strip() for s in sentences]
+    if sentences and not sentences[-1]:
+        sentences = sentences[:-1]
+    return sentences
+
+
+def fuzz_texts(count: int, seed: int = 0) -> list[str]:
+    """Build random texts out of the tokens the splitting rules are about."""
+    rng = random.Random(seed)  # noqa: S311
+    return [
+        "".join(rng.choice(FUZZ_TOKENS) + rng.choice(FUZZ_SEPARATORS) for _ in range(rng.randint(0, 12)))
+        for _ in range(count)
+    ]
+
+
+def check(texts: list[str]) -> int:
+    """Compare both implementations, print the differences and return how many texts differ."""
+    failures = 0
+    for text in texts:
+        expected = legacy_split_into_sentences(text)
+        if (actual := split_into_sentences(text)) != expected:
+            failures += 1
+            print(f"{text!r}\n  expected {expected!r}\n  actual   {actual!r}")
+    return failures
+
+
+def benchmark(article: str, number: int = 20) -> None:
+    """Print the throughput of both implementations on an article."""
+    for name, function in (("legacy", legacy_split_into_sentences), ("single pass", split_into_sentences)):
+        seconds = min(timeit.repeat(lambda f=function: f(article), number=number, repeat=5)) / number
+        print(f"{name:>12}: {seconds * 1000:8.2f} ms per article, {len(article) / seconds / 1e6:6.2f} M chars/s")
+
+
+def main() -> None:
+    """Run the regression checks, then the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fuzz", type=int, default=50_000, help="number of random texts to compare")
+    parser.add_argument("--article-size", type=int, default=200_000, help="length of the benchmark article")
+    args = parser.parse_args()
+
+    failures = check(CORPUS) + check(fuzz_texts(args.fuzz))
+    print(f"{len(CORPUS)} corpus texts and {args.fuzz} random texts compared, {failures} differ")
+
+    paragraphs = "\n".join(CORPUS)
+    article = (paragraphs * (args.article_size // len(paragraphs) + 1))[: args.article_size]
+    benchmark(article)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 import asyncio
+import contextlib
 import json
-import random
 import re
 import time
+from collections.abc import AsyncIterator
 
 import discord
 import wikipedia
@@ -10,8 +11,72 @@ from discord import app_commands
 from discord.ext import commands
 from repositories.wiki_repo import FactsView
 from utils.database import db
-from utils.gemini import gemini_client
-from utils.wiki import create_false_statement, get_wiki_facts, get_wiki_image
+from utils.gemini import GeminiBusyError, GeminiError, gemini_client, is_message
+from utils.jsonstream import ArrayParser, partial_string
+from utils.members import member_sampler
+from utils.puzzles import puzzle_pool
+from utils.transcript import read_history, transcript_cache
+from utils.webhooks import WebhookPayload, deliver, webhook_registry
+from utils.wiki import TooFewSentencesError
+
+
+def busy_embed() -> discord.Embed:
+    """Return the embed telling the user that Gemini is busy."""
+    return discord.Embed(
+        title="Error",
+        description="Too many requests right now, please try again in a minute.",
+        color=discord.Color.red(),
+    )
+
+
+class ThrottledEmbedEditor:
+    """Show an embed as the response to an interaction while its description is still being written.
+
+    Updates are coalesced, the response is edited at most once per `interval`
+    seconds and always with the latest description.
+
+    Parameters
+    ----------
+    interaction
+        The deferred `discord.Interaction` to respond to.
+    embed
+        The `discord.Embed` to show.
+    interval : float, optional
+        Minimum seconds between edits (default is 1).
+
+    """
+
+    def __init__(self, interaction: discord.Interaction, embed: discord.Embed, interval: float = 1) -> None:
+        self.interaction = interaction
+        self.embed = embed
+        self.interval = interval
+        self._edited = 0.0
+        self._pending: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def update(self, description: str) -> None:
+        """Show a new description, as soon as the rate allows."""
+        self.embed.description = description
+        if self._pending is None:
+            self._pending = asyncio.create_task(self._flush())
+
+    async def finish(self, embed: discord.Embed) -> None:
+        """Show the final embed right away, dropping the updates not shown yet."""
+        if self._pending is not None:
+            self._pending.cancel()
+        self.embed = embed
+        async with self._lock:
+            await self.interaction.edit_original_response(embed=self.embed)
+
+    async def _flush(self) -> None:
+        """Edit the response once the interval since the last edit has passed."""
+        await asyncio.sleep(self._edited + self.interval - time.monotonic())
+        async with self._lock:
+            self._pending = None
+            self._edited = time.monotonic()
+            # A failed intermediate edit is made up for by the next one
+            with contextlib.suppress(discord.HTTPException):
+                await self.interaction.edit_original_response(embed=self.embed)
 
 
 class FactCommand(commands.Cog):
@@ -36,6 +101,30 @@ class FactCommand(commands.Cog):
     def __init__(self, bot: commands.Bot) -> None:
         self.bot = bot
 
+    async def cog_load(self) -> None:
+        """Start warming factpedia puzzles when the cog is loaded."""
+        puzzle_pool.start()
+
+    @commands.Cog.listener()
+    async def on_webhooks_update(self, channel: discord.abc.GuildChannel) -> None:
+        """Drop the channel's cached webhook."""
+        webhook_registry.invalidate(channel.id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        """Drop the edited message from the transcript cache."""
+        transcript_cache.invalidate(payload.channel_id, [payload.message_id])
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        """Drop the deleted message from the transcript cache."""
+        transcript_cache.invalidate(payload.channel_id, [payload.message_id], deleted=True)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
+        """Drop the deleted messages from the transcript cache."""
+        transcript_cache.invalidate(payload.channel_id, payload.message_ids, deleted=True)
+
     @app_commands.command(name="discuss")
     async def discuss(self, interaction: discord.Interaction, topic: str) -> None:
         """Create a discussion on the given topic.
@@ -50,57 +139,129 @@ class FactCommand(commands.Cog):
         """
         await interaction.response.defer()
 
-        # Generate convo from gemini
-        conversation = await gemini_client.generate_conversation(topic)
-        data = json.loads(conversation)
+        # Assign users for the generated convo
+        convo_starter = interaction.user
+        users = [convo_starter, *member_sampler.sample(interaction.guild, 2, exclude=[convo_starter.id])]
+
+        # Send each line as soon as it is generated, resolving the webhook meanwhile
+        queue: asyncio.Queue[WebhookPayload | None] = asyncio.Queue()
+
+        async def payloads() -> AsyncIterator[WebhookPayload]:
+            while (payload := await queue.get()) is not None:
+                yield payload
+
+        delivery = asyncio.create_task(deliver(interaction.channel, payloads()))
+        try:
+            await self.queue_conversation(interaction, topic, users, queue)
+            await delivery
+        finally:
+            # Still running if generating the conversation failed
+            delivery.cancel()
+            await asyncio.gather(delivery, return_exceptions=True)
+
+    async def queue_conversation(
+        self,
+        interaction: discord.Interaction,
+        topic: str,
+        users: list[discord.abc.User],
+        queue: asyncio.Queue[WebhookPayload | None],
+    ) -> None:
+        """Queue the lines of a conversation as they are generated, or respond with an error if there are none.
+
+        Parameters
+        ----------
+        interaction
+            The deferred interaction to respond to.
+        topic : str
+            Discussion topic.
+        users : list[discord.abc.User]
+            The users to send the lines as.
+        queue : asyncio.Queue[WebhookPayload | None]
+            The queue to put the lines in, followed by None.
+
+        """
+        parser = ArrayParser()
+        conversation = ""
+        sent = 0
+        try:
+            async for conversation in gemini_client.stream_conversation(topic):
+                for message in filter(is_message, parser.feed(conversation)):
+                    if not sent:
+                        # Send convo start embed
+                        embed = discord.Embed(
+                            title=f"You have started a discussion on the topic: **{topic}**",
+                            color=discord.Color.blurple(),
+                        )
+                        await interaction.followup.send(content=None, embed=embed)
+                    user = users[message["userid"] % len(users)]
+                    queue.put_nowait(WebhookPayload.from_user(user, message["message"], len(message["message"]) / 7))
+                    sent += 1
+        except GeminiBusyError:
+            await interaction.followup.send(embed=busy_embed())
+            return
+        finally:
+            queue.put_nowait(None)
 
         # Verify data structure
-        if isinstance(data, dict):
-            message = data.get("summary", "Failed to generate a conversation on given topic.")
+        if not sent:
+            try:
+                data = json.loads(conversation)
+            except ValueError:
+                data = {}
+            message = data.get("summary") if isinstance(data, dict) else None
             embed = discord.Embed(
                 title="Error",
-                description=message,
+                description=message or "Failed to generate a conversation on given topic.",
                 color=discord.Color.red(),
             )
             await interaction.followup.send(content=None, embed=embed)
-            return
 
-        # Send convo start embed
-        embed = discord.Embed(
-            title=f"You have started a discussion on the topic: **{topic}**",
-            color=discord.Color.blurple(),
-        )
-        await interaction.followup.send(content=None, embed=embed)
+    async def send_summary(
+        self,
+        interaction: discord.Interaction,
+        title: str,
+        text: str,
+        footer: str | None = None,
+    ) -> None:
+        """Respond with a summary of the conversation, shown as it is being written.
 
-        # Assign users for the generated convo
-        convo_starter = interaction.user
-        other_users = random.sample(
-            [member for member in interaction.guild.members if not (member.bot or member == convo_starter)],
-            k=2,
-        )
-        users = [convo_starter, *other_users]
+        Parameters
+        ----------
+        interaction
+            The deferred interaction to respond to.
+        title : str
+            Title of the summary embed.
+        text : str
+            Conversation to summarize.
+        footer : str, optional
+            Footer of the summary embed (default is none).
 
-        # Set up webhooks with server
-        webhooks = await interaction.channel.webhooks()
-        if not webhooks:
-            webhook = await interaction.channel.create_webhook(name="Discussion")
-        else:
-            for webhook in webhooks:
-                if webhook.token:
-                    break
-            else:
-                webhook = await interaction.channel.create_webhook(name="Discussion")
-
-        # Send messages
-        for message in data:
-            user = users[message["userid"] % len(users)]
-            avatar_url = user.avatar.url if user.avatar else user.default_avatar.url
-            await asyncio.sleep(len(message["message"]) / 7)
-            await webhook.send(
-                content=message["message"],
-                username=user.display_name,
-                avatar_url=avatar_url,
+        """
+        editor = ThrottledEmbedEditor(interaction, discord.Embed(title=title, color=discord.Color.blurple()))
+        response = ""
+        try:
+            async for response in gemini_client.stream_summary(text):
+                if partial := partial_string(response, "summary"):
+                    editor.update(partial)
+        except GeminiBusyError:
+            await editor.finish(busy_embed())
+            return
+
+        try:
+            embed = discord.Embed(
+                title=title,
+                description=json.loads(response)["summary"],
+                color=discord.Color.blurple(),
+            )
+        except (ValueError, TypeError, KeyError):
+            embed = discord.Embed(
+                title="Error",
+                description="Failed to summarize the conversation.",
+                color=discord.Color.red(),
             )
+        else:
+            embed.set_footer(text=footer)
+        await editor.finish(embed)
 
     @app_commands.command(name="summarize")
     async def summarize(self, interaction: discord.Interaction, text: str) -> None:
@@ -115,23 +276,7 @@ class FactCommand(commands.Cog):
 
         """
         await interaction.response.defer()
-        summary = await gemini_client.summarize_conversation(text)
-        if summary:
-            summarized_text = json.loads(summary)["summary"]
-            embed = discord.Embed(
-                title="Summary",
-                description=summarized_text,
-                color=discord.Color.blurple(),
-            )
-
-            await interaction.followup.send(content=None, embed=embed)
-        else:
-            embed = discord.Embed(
-                title="Error",
-                description="Failed to summarize the conversation.",
-                color=discord.Color.red(),
-            )
-            await interaction.followup.send(content=None, embed=embed)
+        await self.send_summary(interaction, "Summary", text)
 
     @app_commands.command(name="shortify")
     async def shortify(self, interaction: discord.Interaction, start: str, end: str) -> None:
@@ -152,22 +297,12 @@ class FactCommand(commands.Cog):
                 return int(match.group(1))
             raise ValueError
 
-        async def convert_user_tags(message: discord.Message) -> str:
-            def replace_tag(match: re.Match) -> str:
-                """Replace user's ID with user's display name."""
-                user_id = int(match.group(1))
-                user = message.guild.get_member(user_id)
-                return f"{user.display_name}" if user else match.group(0)
-
-            return re.sub(r"<@?(\d+)>", replace_tag, message.content)
-
         channel = interaction.channel
         await interaction.response.defer()
 
-        # Messages verification
+        # Messages verification, then read the messages in-between within budget
         try:
-            msg1 = await channel.fetch_message(parse_msg_id(start))
-            msg2 = await channel.fetch_message(parse_msg_id(end))
+            transcript = await read_history(channel, parse_msg_id(start), parse_msg_id(end))
         except (discord.NotFound, ValueError):
             embed = discord.Embed(
                 title="Error",
@@ -177,35 +312,20 @@ class FactCommand(commands.Cog):
             await interaction.followup.send(embed=embed)
             return
 
-        # Ensure msg1 is the older message
-        if msg1.created_at > msg2.created_at:
-            msg1, msg2 = msg2, msg1
-
-        # Attach start and end messages
-        messages = (
-            [msg1] + [message async for message in channel.history(after=msg1, before=msg2, limit=None)] + [msg2]
-        )
-
-        # Turn into readable convo
-        msg_contents = "\n".join([f"{msg.author.display_name}: {await convert_user_tags(msg)}" for msg in messages])
+        notes = []
+        if transcript.sampled:
+            notes.append("messages in the middle were skipped")
+        if transcript.truncated:
+            notes.append("a long message was cut short")
+        footer = f"Too long to summarize in full: {' and '.join(notes)}." if notes else None
 
         # Gemini summarize and return result
-        summary = await gemini_client.summarize_conversation(msg_contents)
-        if summary:
-            summarized_text = json.loads(summary)["summary"]
-            embed = discord.Embed(
-                title=f"**Summary** from {msg1.jump_url} to {msg2.jump_url}",
-                description=summarized_text,
-                color=discord.Color.blurple(),
-            )
-            await interaction.followup.send(content=None, embed=embed)
-        else:
-            embed = discord.Embed(
-                title="Error",
-                description="Failed to summarize the conversation.",
-                color=discord.Color.red(),
-            )
-            await interaction.followup.send(content=None, embed=embed)
+        await self.send_summary(
+            interaction,
+            f"**Summary** from {transcript.start.jump_url} to {transcript.end.jump_url}",
+            transcript.text(),
+            footer,
+        )
 
     @app_commands.command()
     async def factpedia(self, interaction: discord.Interaction, entry: str, number: int = 5) -> None:
@@ -223,9 +343,9 @@ class FactCommand(commands.Cog):
         """
         await interaction.response.defer()
 
-        # Fetching facts from Wiki
+        # Fetching facts from Wiki, with 1 fact altered to become incorrect, from the warm pool if ready
         try:
-            facts = get_wiki_facts(entry, number=number)
+            puzzle = await puzzle_pool.get(interaction.guild_id, entry, number)
         except wikipedia.DisambiguationError:
             await interaction.followup.send(
                 f"""The prompt **{entry}** can refer to many different things, please be more specific!""",
@@ -236,11 +356,19 @@ class FactCommand(commands.Cog):
                 f"The prompt **{entry}** did not match any of our searches. Please try again with a differently worded prompt / query.",  # noqa: E501
             )
             return
-
-        # Alter 1 fact to become incorrect
-        false_index = random.randint(0, number - 1)  # noqa: S311
-        correction = facts[false_index]
-        facts[false_index] = create_false_statement(facts[false_index])
+        except TooFewSentencesError:
+            await interaction.followup.send(
+                f"The article **{entry}** is too short for {number} statements, please ask for fewer.",
+            )
+            return
+        except GeminiBusyError:
+            await interaction.followup.send(embed=busy_embed())
+            return
+        except GeminiError:
+            await interaction.followup.send(
+                f"Could not come up with a false statement about **{entry}**. Please try again later.",
+            )
+            return
 
         # Create embeds for statements
         statements_embed = discord.Embed(
@@ -248,10 +376,10 @@ class FactCommand(commands.Cog):
             description=f"Topic: **{entry}**",
             colour=discord.Colour.random(),
         )
-        for i in range(len(facts)):
-            statements_embed.add_field(name=f"Statement #{i+1}", value=facts[i], inline=False)
-        if url := get_wiki_image(entry):
-            statements_embed.set_thumbnail(url=url)
+        for i in range(len(puzzle.facts)):
+            statements_embed.add_field(name=f"Statement #{i+1}", value=puzzle.facts[i], inline=False)
+        if puzzle.image:
+            statements_embed.set_thumbnail(url=puzzle.image)
 
         # Create embed for more info
         question_embed = discord.Embed(
@@ -262,9 +390,9 @@ class FactCommand(commands.Cog):
         # Send the message containing 2 embeds and a drop select
         view = FactsView(
             embed=statements_embed,
-            facts=facts,
-            false_index=false_index,
-            correction=correction,
+            facts=puzzle.facts,
+            false_index=puzzle.false_index,
+            correction=puzzle.correction,
             caller=interaction.user.id,
         )
         view.message = await interaction.followup.send(
@@ -275,12 +403,16 @@ class FactCommand(commands.Cog):
     @app_commands.command(name="hello")
     async def hello(self, interaction: discord.Interaction) -> None:
         """Say hello!."""
+        # The fun fact may wait for a free request
+        await interaction.response.defer()
         msg = f"Hi, {interaction.user.mention}."
-        fact = await gemini_client.name_fun_fact(interaction.user.display_name)
-        fact = json.loads(fact)["fun_fact"]
+        try:
+            fact = json.loads(await gemini_client.name_fun_fact(interaction.user.display_name))["fun_fact"]
+        except (GeminiBusyError, ValueError, TypeError, KeyError):
+            fact = "False"
         if fact != "False":
             msg += f"\nDid you know: {fact}"
-        await interaction.response.send_message(msg)
+        await interaction.followup.send(msg)
 
 
 async def setup(bot: commands.Bot) -> None:
@@ -1,22 +1,27 @@
 import asyncio
 import io
+import math
 import time
 from collections import defaultdict
 
 import discord
 from discord.ext import commands
 from repositories import quiz_repo
+from utils.catalogue import catalogue
 from utils.database import db
 from utils.leaderboard import generate_quiz_leaderboard_image
+from utils.leaderboard_cache import leaderboard_cache
+from utils.opentdb import OpenTDBError
+from utils.question_bank import question_bank
 from utils.quiz import (
-    create_api_call,
-    get_quizzes_with_token,
+    QuestionPrefetcher,
     get_sub_topic_id,
     get_top_participants,
     get_topic_id,
     has_sub_topic,
     result_embed,
 )
+from utils.registry import command_registry
 
 VOTING_TIME = quiz_repo.voting_time()
 
@@ -28,6 +33,11 @@ class QuizCommand(commands.Cog):
         """Initialize QuizCommand cog."""
         self.bot = bot
 
+    async def cog_load(self) -> None:
+        """Load the quiz topics and start filling the question bank when the cog is loaded."""
+        await catalogue.load()
+        question_bank.start()
+
     @discord.app_commands.command(name="score")
     async def score(
         self,
@@ -63,8 +73,9 @@ class QuizCommand(commands.Cog):
     async def leaderboard(self, interaction: discord.Interaction) -> None:
         """Return the server's leaderboabrd."""
         await interaction.response.defer()
-        leaderboard = await db.get_leaderboard(interaction.guild_id)
-        embed = await result_embed(interaction, leaderboard, 5)
+        leaderboard = await leaderboard_cache.get_leaderboard(interaction.guild_id)
+        top_users = await get_top_participants(interaction, leaderboard, 5)
+        embed = result_embed(top_users, 5)
         await interaction.followup.send(embed=embed)
 
     @discord.app_commands.command(name="quiz")
@@ -72,10 +83,9 @@ class QuizCommand(commands.Cog):
         """Start new quiz."""
         await interaction.response.defer()
         channel_id = interaction.channel_id
-        server_id = interaction.guild_id
 
-        # Check if there's already an active quiz in this channel
-        if await db.command_is_active("quiz", channel_id):
+        # Check if there's already an active quiz in this channel, otherwise mark quiz started
+        if not await command_registry.claim("quiz", channel_id):
             embed = discord.Embed(
                 title="Quiz",
                 description="**A quiz is already running in this channel.**",
@@ -87,11 +97,18 @@ class QuizCommand(commands.Cog):
             )
             return
 
-        # Mark quiz started
-        await db.set_command_active("quiz", channel_id)
+        try:
+            await self.run_quiz(interaction)
+        finally:
+            # Mark quiz ended
+            await command_registry.release("quiz", channel_id)
+
+    async def run_quiz(self, interaction: discord.Interaction) -> None:
+        """Run the voting, question and results phases of a quiz."""
+        server_id = interaction.guild_id
 
         # Voting phase =====================================================================
-        voting_view = quiz_repo.VotingView()
+        voting_view = quiz_repo.VotingView(catalogue.topics)
         await interaction.followup.send(
             f"Choose your topic! Ends **<t:{int(time.time()) + 11}:R>**",
             view=voting_view,
@@ -113,35 +130,87 @@ class QuizCommand(commands.Cog):
                 embed=embed,
                 view=None,
             )
-            await db.set_command_inactive("quiz", channel_id)
             return
 
-        # For dynamic topic
-        if has_sub := has_sub_topic(topic):
-            topic_id_correct_count = defaultdict(int)
+        # For dynamic topic, only the subtopic of the first question gets a small buffer now, the others are
+        # fetched once picked so that they never wait behind fetches which may not be used. Otherwise fetch the
+        # whole quiz now
+        prefetcher = QuestionPrefetcher(server_id, number)
+        if has_sub_topic(topic):
+            topic_id = get_sub_topic_id(topic, {})
+            prefetcher.prefetch(topic_id, min(prefetcher.buffer_size, number))
+        else:
+            topic_id = get_topic_id(topic)
+            prefetcher.prefetch(topic_id, number)
+
+        try:
+            participants = await self.ask_questions(interaction, prefetcher, topic, topic_id, number)
+        finally:
+            prefetcher.close()
+
+        # Quiz is cancelled
+        if participants is None:
+            return
+
+        # Results =============================================================================
+        top_participants = await get_top_participants(interaction, participants)
+        embed = result_embed(top_participants, 3)
+        await interaction.channel.send(content="## Quiz ended", embed=embed)
+        if top_participants:
+            image = await generate_quiz_leaderboard_image(top_participants)
+            await interaction.channel.send(
+                file=discord.File(fp=io.BytesIO(image), filename="leaderboard.png"),
+            )
+
+    async def ask_questions(
+        self,
+        interaction: discord.Interaction,
+        prefetcher: QuestionPrefetcher,
+        topic: str,
+        topic_id: int,
+        number: int,
+    ) -> dict[int, int] | None:
+        """Ask the questions of a quiz, return the number of correct answers per user, None if it was cancelled.
+
+        `topic_id` is the (sub)topic of the first question.
+        """
+        server_id = interaction.guild_id
+        has_sub = has_sub_topic(topic)
+        topic_id_correct_count = defaultdict(int)
 
         # Question phase ====================================================================
         participants = defaultdict(int)
+        players = set()
         for i in range(1, number + 1):
             async with interaction.channel.typing():
                 # Get topic id dynamically based on previous answers
-                topic_id = get_sub_topic_id(topic, topic_id_correct_count) if has_sub else get_topic_id(topic)
-
-                # Fetch question
-                quiz = await get_quizzes_with_token(
-                    server_id,
-                    create_api_call(1, topic_id),
-                )
-                quiz = quiz[0]
-
-                # Send the question and store in view
-                content = f"### {i}) {quiz['question']} {'Quiz ends ' if i == number else 'Next '} **<t:{int(time.time()) + 11}:R>**"  # noqa: E501
+                if has_sub and i > 1:
+                    topic_id = get_sub_topic_id(topic, topic_id_correct_count)
+
+                # Take the next prefetched question
+                try:
+                    quiz = await prefetcher.get(topic_id)
+                except OpenTDBError:
+                    embed = discord.Embed(
+                        title="Quiz is cancelled.",
+                        description="Could not fetch the next question, please try again later.",
+                        color=discord.Color.red(),
+                    )
+                    await interaction.channel.send(embed=embed)
+                    return None
+
+                # Send the question and store in view, it ends early once everyone who played so far answered.
+                # The countdown shows the same deadline, and is removed when the question ends
+                deadline = time.monotonic() + VOTING_TIME
+                ends_at = math.ceil(time.time() + VOTING_TIME)
+                content = f"### {i}) {quiz['question']} {'Quiz ends ' if i == number else 'Next '} **<t:{ends_at}:R>**"
                 question_view = quiz_repo.QuestionView(
                     i,
                     quiz["question"],
                     quiz["correct_answer"],
                     quiz["incorrect_answers"],
                     quiz["type"],
+                    expected=players.copy(),
                 )
                 question_view.message = await interaction.channel.send(
                     content=content,
@@ -150,34 +219,21 @@ class QuizCommand(commands.Cog):
                 )
 
             # Set timer
-            await asyncio.sleep(VOTING_TIME)
+            await question_view.wait_answers(deadline)
             correct_users = await question_view.on_timeout()
+            players.update(question_view.user_answers)
 
             # Track correct answers
             for user_id in correct_users:
                 participants[user_id] += 1
-                score = await db.get_score(user_id, server_id)
-                await db.set_score(user_id, server_id, score + 1)
 
                 # Register topic_id is correctly answered (for dynamic topic)
                 if has_sub:
                     topic_id_correct_count[topic_id] += 1
 
-        # Results =============================================================================
-        embed = await result_embed(interaction, participants, 3)
-        await interaction.channel.send(content="## Quiz ended", embed=embed)
-        top_participants = await get_top_participants(interaction, participants)
-        if top_participants:
-            image = await generate_quiz_leaderboard_image(top_participants)
-            with io.BytesIO() as image_binary:
-                image.save(image_binary, "PNG")
-                image_binary.seek(0)
-                await interaction.channel.send(
-                    file=discord.File(fp=image_binary, filename="leaderboard.png"),
-                )
+            await leaderboard_cache.increment_scores(server_id, dict.fromkeys(correct_users, 1))
 
-        # Mark quiz ended
-        await db.set_command_inactive("quiz", channel_id)
+        return participants
 
 
 async def setup(bot: commands.Bot) -> None:
@@ -54,16 +54,26 @@ class Bot(commands.Bot):
 
     async def setup_hook(self) -> None:
         """Setups hook for the bot."""
+        from utils.database import db
+
+        # Commands left active by a previous run are not running anymore. Clearing them first also drops
+        # duplicates an older version may have left, which would fail the unique index on the cache
+        await db.clear_command_cache()
+        await db.ensure_indexes()
         # This copies the global commands over to your guild.
         await self.load_extensions()
         await self.tree.sync()
 
+    async def close(self) -> None:
+        """Close the shared HTTP session along with the bot."""
+        from utils.http import http_client
+
+        await http_client.close()
+        await super().close()
+
     @watch(path="cogs", default_logger=False)
     async def on_ready(self) -> None:
         """Call when bot is logged in."""
-        from utils.database import db
-
-        await db.clear_command_cache()
         await bot.change_presence(activity=discord.Game(name="/help"))
         logger.info("Logged in as %s (ID: %s)", bot.user, bot.user.id)
 
@@ -1,30 +1,39 @@
+import asyncio
+import contextlib
 import random
+import time
 
 import discord
 from discord.ui import Button, View
-from utils.quiz import fetch_categories, learn_more_url
+from utils.quiz import LEARN_MORE_DEFAULT_URL, learn_more_url
 
 VOTING_TIME = 10
+LEARN_MORE_TIMEOUT = 2
 
 
 class VotingView(View):
     """Topic voting message. Subclasses `View`.
 
+    Parameters
+    ----------
+    topic_ids : dict
+        A topic pool as held by `utils.catalogue.catalogue`.
+
     Attributes
     ----------
     user_votes : dict
         Collection of topics and their corresponding votes.
     topic_ids : dict
-        A topic pool as returned by `utils.quiz.fetch_categories`.
+        A topic pool as held by `utils.catalogue.catalogue`.
     cancel_button
         A `CancelButton` instance corresponding to a cancel button in this voting UI.
 
     """
 
-    def __init__(self) -> None:
+    def __init__(self, topic_ids: dict) -> None:
         super().__init__(timeout=None)
         self.user_votes = {}
-        self.topic_ids = fetch_categories()
+        self.topic_ids = topic_ids
         self.message: discord.Message = None
 
         for topic in [*random.sample(list(self.topic_ids.keys()), 3), "Random"]:
@@ -226,15 +235,22 @@ class QuestionView(View):
         Correct answer to question.
     incorrects : list
         Collection of incorrect answers.
-    voting_view
-        The `VotingView` instance this button is added to.
     type : str
         Question type.
+    expected : set[int], optional
+        IDs of the users expected to answer, e.g. those who answered earlier
+        questions of the quiz (default is none).
 
     Attributes
     ----------
     user_answers : dict
         A dictionary corresponding to users and answers.
+    expected : set[int]
+        IDs of the users expected to answer.
+    answered : asyncio.Event
+        Set once every expected user answered.
+    closed : bool
+        Whether the question ended, answers are ignored from then on.
     i : int
         Question index.
     question : str
@@ -243,19 +259,33 @@ class QuestionView(View):
         Correct answer to question.
     incorrects : list
         Collection of incorrect answers.
-    url : str
-        An URL as returned by `utils.wiki.learn_more_url`.
+    url_task
+        Background lookup of the URL returned by `utils.quiz.learn_more_url`,
+        started right away so that it is ready when the question ends.
 
     """
 
-    def __init__(self, i: int, question: str, correct: str, incorrects: list, type: str) -> None:
+    def __init__(
+        self,
+        i: int,
+        question: str,
+        correct: str,
+        incorrects: list,
+        type: str,
+        expected: set[int] | None = None,
+    ) -> None:
         super().__init__(timeout=None)
         self.user_answers = {}
+        self.expected = expected or set()
+        self.answered = asyncio.Event()
+        self.closed = False
         self.i = i
         self.question = question
         self.correct = correct
         self.incorrects = incorrects
-        self.url = learn_more_url(self.question)
+        self.url_task = asyncio.create_task(learn_more_url(question))
+        # A lookup which outlives the question fails silently
+        self.url_task.add_done_callback(lambda task: task.cancelled() or task.exception())
         self.message: discord.Message = None
 
         if type == "multiple":
@@ -267,6 +297,34 @@ class QuestionView(View):
         for answer in answers:
             self.add_item(AnswerButton(label=answer, question_view=self))
 
+    def register_answer(self, user_id: int, answer: str) -> bool:
+        """Store a user's answer, setting `answered` once every expected user answered.
+
+        Returns
+        -------
+        bool
+            Whether the answer was stored, i.e. the question was not closed yet.
+
+        """
+        if self.closed:
+            return False
+        self.user_answers[user_id] = answer
+        if self.expected and self.expected.issubset(self.user_answers):
+            self.answered.set()
+        return True
+
+    async def wait_answers(self, deadline: float) -> None:
+        """Wait until every expected user answered, or the deadline passed.
+
+        Parameters
+        ----------
+        deadline : float
+            `time.monotonic` time the question ends at.
+
+        """
+        with contextlib.suppress(TimeoutError):
+            await asyncio.wait_for(self.answered.wait(), timeout=max(deadline - time.monotonic(), 0))
+
     async def on_timeout(self) -> list:
         """After timeout, highlight correct answer.
 
@@ -276,14 +334,22 @@ class QuestionView(View):
             IDs of users who answered correctly.
 
         """
+        # Answers arriving while the buttons are being disabled no longer count
+        self.closed = True
+
         # Highlight correct answer, disable all buttons
         for child in self.children:
             if child.label == self.correct:
                 child.style = discord.ButtonStyle.success
             child.disabled = True
 
-        # Add Learn More button
-        self.add_item(LearnMoreButton(url=self.url))
+        # Add Learn More button, without holding the question up for a slow or failed lookup.
+        # A slow lookup keeps running, so that its result is cached for the next time
+        try:
+            url = await asyncio.wait_for(asyncio.shield(self.url_task), timeout=LEARN_MORE_TIMEOUT)
+        except Exception:
+            url = LEARN_MORE_DEFAULT_URL
+        self.add_item(LearnMoreButton(url=url))
 
         try:
             await self.message.edit(content=f"### {self.i}) {self.question}", view=self)
@@ -317,8 +383,9 @@ class AnswerButton(Button):
 
     async def callback(self, interaction: discord.Interaction) -> None:
         """Register user's answer."""
-        user_id = interaction.user.id
-        self.question_view.user_answers[user_id] = self.label
+        if not self.question_view.register_answer(interaction.user.id, self.label):
+            await interaction.response.send_message("This question has already ended.", ephemeral=True)
+            return
         await interaction.response.edit_message(view=self.question_view)
 
 
@@ -328,7 +395,7 @@ class LearnMoreButton(Button):
     Parameters
     ----------
     url : str
-        An url as returned by `utils.wiki.learn_more_url`.
+        An url as returned by `utils.quiz.learn_more_url`.
 
     """
 
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+from utils.jsonstream import ArrayParser, partial_string
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("", None),
+        ('{"summary"', None),
+        ('{"summary": ', None),
+        ('{"summary": "', ""),
+        ('{"summary": "Hello wor', "Hello wor"),
+        ('{"summary": "Hello world", "other": "x"}', "Hello world"),
+        ('{"title": "a", "summary" : "b', "b"),
+        # Escapes are only decoded once fully received
+        ('{"summary": "a\\', "a"),
+        ('{"summary": "a\\n', "a\n"),
+        # Raw control characters are taken as they are
+        ('{"summary": "line one\nline', "line one\nline"),
+        ('{"summary": "a\tb"}', "a\tb"),
+        ('{"summary": "say \\"hi\\"', 'say "hi"'),
+        ('{"summary": "\\u00e', ""),
+        ('{"summary": "\\u00e9', "é"),
+        # Surrogate pairs are only decoded together
+        ('{"summary": "x\\ud83d', "x"),
+        ('{"summary": "x\\ud83d\\ude0', "x"),
+        ('{"summary": "x\\ud83d\\ude00', "x😀"),
+    ],
+)
+def test_partial_string(text: str, expected: str | None) -> None:
+    """Decode the part of a string member received so far."""
+    assert partial_string(text, "summary") == expected
+
+
+def feed(chunks: list[str]) -> tuple[list, ArrayParser]:
+    """Feed the text of an array a chunk at a time, return the elements in the order they were returned."""
+    parser = ArrayParser()
+    text = ""
+    elements = []
+    for chunk in chunks:
+        text += chunk
+        elements += parser.feed(text)
+    return elements, parser
+
+
+ARRAY = json.dumps(
+    [
+        {"name": "Ada", "message": 'She said "hi", then [left] {quickly}.'},
+        {"name": "Bob", "message": "Back\\slash and é"},
+        [1, [2, 3]],
+        "plain, string",
+        42,
+        None,
+        True,
+    ],
+)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, len(ARRAY)])
+def test_array_parser_chunks(size: int) -> None:
+    """Return every element once, however the text is split into chunks."""
+    elements, parser = feed([ARRAY[i : i + size] for i in range(0, len(ARRAY), size)])
+    assert elements == json.loads(ARRAY)
+    assert parser.done
+
+
+def test_array_parser_returns_elements_early() -> None:
+    """Return objects once closed, and scalars once the separator after them arrives."""
+    parser = ArrayParser()
+    assert parser.feed('[{"a": 1') == []
+    assert parser.feed('[{"a": 1}') == [{"a": 1}]
+    assert parser.feed('[{"a": 1}, 2') == []
+    assert parser.feed('[{"a": 1}, 2,') == [2]
+    assert parser.feed('[{"a": 1}, 2, 3]') == [3]
+    assert parser.done
+    assert parser.feed('[{"a": 1}, 2, 3] trailing') == []
+
+
+def test_array_parser_skips_invalid_elements() -> None:
+    """Skip elements which are not valid JSON, keeping the rest."""
+    elements, parser = feed(['[1, nope, {"a": }, ', '{"b": 2}]'])
+    assert elements == [1, {"b": 2}]
+    assert parser.done
+
+
+def test_array_parser_empty_array() -> None:
+    """Return no elements for an empty array."""
+    elements, parser = feed(["[", " ]"])
+    assert elements == []
+    assert parser.done
+
+
+def test_array_parser_object() -> None:
+    """Stop at a text which is an object rather than an array."""
+    elements, parser = feed(['{"a": [1, 2]}'])
+    assert elements == []
+    assert parser.done
+
+
+def test_array_parser_text_replaced() -> None:
+    """Stop once the text no longer extends the previous text."""
+    parser = ArrayParser()
+    assert parser.feed("[1, 2,") == [1, 2]
+    assert parser.feed("[3,") == []
+    assert parser.done
@@ -0,0 +1,211 @@
+import asyncio
+import time
+from collections.abc import Awaitable, Callable
+
+import pytest
+from utils.scheduler import Priority, RequestScheduler
+
+# Requests per minute high enough for the bucket not to get in the way
+FAST = 60_000
+
+
+class RateLimitedError(Exception):
+    """Stands in for the API's rate limit error."""
+
+
+async def noop() -> None:
+    """Make a request which returns right away."""
+
+
+def recorder(order: list[str], name: str) -> Callable[[], Awaitable[str]]:
+    """Return a request which records that it ran."""
+
+    async def request() -> str:
+        order.append(name)
+        return name
+
+    return request
+
+
+async def blocked(scheduler: RequestScheduler) -> tuple[asyncio.Task, asyncio.Event]:
+    """Start a request holding the only slot until the returned event is set."""
+    release = asyncio.Event()
+    task = asyncio.create_task(scheduler.run(release.wait))
+    await asyncio.sleep(0)
+    return task, release
+
+
+def test_concurrency_limit() -> None:
+    """Never run more requests at once than allowed."""
+
+    async def main() -> int:
+        scheduler = RequestScheduler(FAST, burst=10, concurrency=2)
+        running = peak = 0
+
+        async def request() -> None:
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(scheduler.run(request) for _ in range(6)))
+        return peak
+
+    assert asyncio.run(main()) == 2
+
+
+def test_token_bucket() -> None:
+    """Start requests beyond the burst only once a token was refilled."""
+
+    async def main() -> float:
+        scheduler = RequestScheduler(600, burst=1)
+        started = time.monotonic()
+        await asyncio.gather(scheduler.run(noop), scheduler.run(noop))
+        return time.monotonic() - started
+
+    # 600 requests per minute refill a token every 0.1 seconds
+    assert asyncio.run(main()) >= 0.09
+
+
+def test_priority_order() -> None:
+    """Admit higher priorities first, and equal priorities in the order they came."""
+
+    async def main() -> list[str]:
+        scheduler = RequestScheduler(FAST, burst=10, concurrency=1)
+        order = []
+        task, release = await blocked(scheduler)
+        requests = [
+            scheduler.run(recorder(order, "background"), Priority.BACKGROUND),
+            scheduler.run(recorder(order, "normal 1"), Priority.NORMAL),
+            scheduler.run(recorder(order, "interactive"), Priority.INTERACTIVE),
+            scheduler.run(recorder(order, "normal 2"), Priority.NORMAL),
+        ]
+        waiting = asyncio.gather(*requests)
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(task, waiting)
+        return order
+
+    assert asyncio.run(main()) == ["interactive", "normal 1", "normal 2", "background"]
+
+
+def test_coalesce() -> None:
+    """Run identical requests in flight once and share the result."""
+
+    async def main() -> tuple[list[str], RequestScheduler]:
+        scheduler = RequestScheduler(FAST, burst=10)
+        calls = []
+        request = recorder(calls, "result")
+        results = await asyncio.gather(*(scheduler.submit("key", request) for _ in range(3)))
+        assert results == ["result"] * 3
+        # Once done, the same key is requested again
+        await scheduler.submit("key", request)
+        return calls, scheduler
+
+    calls, scheduler = asyncio.run(main())
+    assert len(calls) == 2
+    assert scheduler.stats()["submitted"] == 4
+    assert scheduler.stats()["coalesced"] == 2
+
+
+def test_promote_joined_request() -> None:
+    """Raise a waiting request to the priority of a request joining it."""
+
+    async def main() -> list[str]:
+        scheduler = RequestScheduler(FAST, burst=10, concurrency=1)
+        order = []
+        task, release = await blocked(scheduler)
+        low = asyncio.create_task(scheduler.submit("low", recorder(order, "low"), Priority.BACKGROUND))
+        normal = asyncio.create_task(scheduler.run(recorder(order, "normal"), Priority.NORMAL))
+        await asyncio.sleep(0)
+        joined = asyncio.create_task(scheduler.submit("low", recorder(order, "joined"), Priority.INTERACTIVE))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == 2
+        release.set()
+        await asyncio.gather(task, low, normal, joined)
+        return order
+
+    assert asyncio.run(main()) == ["low", "normal"]
+
+
+def test_cancelled_caller_leaves_request_running() -> None:
+    """Keep a coalesced request running for the others when one caller is cancelled."""
+
+    async def main() -> str:
+        scheduler = RequestScheduler(FAST, burst=10)
+
+        async def request() -> str:
+            await asyncio.sleep(0.01)
+            return "result"
+
+        first = asyncio.create_task(scheduler.submit("key", request))
+        second = asyncio.create_task(scheduler.submit("key", request))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "result"
+
+
+def test_retry_rate_limited() -> None:
+    """Queue a rate limited request again, pausing the scheduler meanwhile."""
+
+    async def main() -> tuple[str, float, RequestScheduler]:
+        scheduler = RequestScheduler(FAST, burst=10, retry_on=(RateLimitedError,), penalty=0.05)
+        attempts = 0
+
+        async def request() -> str:
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise RateLimitedError
+            return "result"
+
+        started = time.monotonic()
+        result = await scheduler.submit("key", request)
+        return result, time.monotonic() - started, scheduler
+
+    result, elapsed, scheduler = asyncio.run(main())
+    assert result == "result"
+    assert elapsed >= 0.04
+    assert scheduler.stats()["rate_limited"] == 1
+
+
+def test_retries_exhausted() -> None:
+    """Raise the rate limit error once a request was retried `retries` times."""
+
+    async def main() -> int:
+        scheduler = RequestScheduler(FAST, burst=10, retry_on=(RateLimitedError,), retries=2, penalty=0)
+        attempts = 0
+
+        async def request() -> None:
+            nonlocal attempts
+            attempts += 1
+            raise RateLimitedError
+
+        with pytest.raises(RateLimitedError):
+            await scheduler.submit("key", request)
+        return attempts
+
+    assert asyncio.run(main()) == 3
+
+
+def test_slot_released_on_error() -> None:
+    """Give the slot back when a request fails with an error that is not retried."""
+
+    async def main() -> dict[str, float]:
+        scheduler = RequestScheduler(FAST, burst=10, concurrency=1)
+
+        async def request() -> None:
+            message = "failed"
+            raise RuntimeError(message)
+
+        with pytest.raises(RuntimeError, match="failed"):
+            await scheduler.run(request)
+        await scheduler.run(noop)
+        return scheduler.stats()
+
+    stats = asyncio.run(main())
+    assert stats["running"] == 0
+    assert stats["queued"] == 0
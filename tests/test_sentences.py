@@ -0,0 +1,37 @@
+import pytest
+from benchmarks.split_into_sentences import CORPUS, fuzz_texts, legacy_split_into_sentences
+from utils.wiki import split_into_sentences
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("", []),
+        ("Hello world", ["Hello world"]),
+        ("Hello world. How are you? I am fine!", ["Hello world.", "How are you?", "I am fine!"]),
+        ("Dr. Jekyll met Mr. Hyde. He ran.", ["Dr. Jekyll met Mr. Hyde.", "He ran."]),
+        ("Apple Inc. is a company. It makes phones.", ["Apple Inc. is a company.", "It makes phones."]),
+        ("Acme Co. They make anvils.", ["Acme Co", "They make anvils."]),
+        ("J. R. R. Tolkien wrote The Hobbit. It sold.", ["J. R. R. Tolkien wrote The Hobbit.", "It sold."]),
+        ("Version 3.12.1 came out. It is fast.", ["Version 3.12.1 came out.", "It is fast."]),
+        ("Visit python.org today. It is free.", ["Visit python.org today.", "It is free."]),
+        ('He said, "This is the end." Then he left.', ['He said, "This is the end".', "Then he left."]),
+        ("Wait... what?", ["Wait...", "what?"]),
+        ("Line one.\nLine two.", ["Line one.", "Line two."]),
+    ],
+)
+def test_split_into_sentences(text: str, expected: list[str]) -> None:
+    """Split on sentence ends, but not on abbreviations, initials, numbers and websites."""
+    assert split_into_sentences(text) == expected
+
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_matches_legacy_on_corpus(text: str) -> None:
+    """Return what the original substitution-pass splitter returned on the regression corpus."""
+    assert split_into_sentences(text) == legacy_split_into_sentences(text)
+
+
+def test_matches_legacy_on_random_texts() -> None:
+    """Return what the original substitution-pass splitter returned on random texts of its tokens."""
+    for text in fuzz_texts(2000):
+        assert split_into_sentences(text) == legacy_split_into_sentences(text), text
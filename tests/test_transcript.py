@@ -0,0 +1,241 @@
+import asyncio
+from collections.abc import AsyncIterator
+from types import SimpleNamespace
+
+import discord
+import pytest
+from utils import transcript
+from utils.transcript import ChannelTranscript, TranscriptCache, read_history
+
+
+class FakeChannel:
+    """A channel holding messages with the given IDs, recording what is fetched from it."""
+
+    def __init__(self, message_ids: list[int], channel_id: int = 1) -> None:
+        self.id = channel_id
+        self.guild = SimpleNamespace(id=1, get_member=lambda _: None)
+        self.messages = {message_id: self.message(message_id) for message_id in message_ids}
+        self.fetched: list[int] = []
+        self.histories: list[tuple[int, int]] = []
+
+    @staticmethod
+    def message(message_id: int, content: str | None = None) -> SimpleNamespace:
+        """Return a message sent by a user named after its ID."""
+        author = SimpleNamespace(display_name=f"user{message_id}")
+        return SimpleNamespace(id=message_id, content=content or f"message {message_id}", author=author)
+
+    async def fetch_message(self, message_id: int) -> SimpleNamespace:
+        """Return a message."""
+        self.fetched.append(message_id)
+        return self.messages[message_id]
+
+    async def history(
+        self,
+        *,
+        after: discord.Object,
+        before: discord.Object,
+        limit: None,
+        oldest_first: bool,
+    ) -> AsyncIterator[SimpleNamespace]:
+        """Iterate over the messages in between two messages."""
+        assert limit is None
+        self.histories.append((after.id, before.id))
+        for message_id in sorted(self.messages, reverse=not oldest_first):
+            if after.id < message_id < before.id:
+                self.fetched.append(message_id)
+                yield self.messages[message_id]
+
+    def get_partial_message(self, message_id: int) -> int:
+        """Stand in for a partial message with its ID."""
+        return message_id
+
+
+async def collect(cache: TranscriptCache, channel: FakeChannel, low: int, high: int, **kwargs: bool) -> list[int]:
+    """Read a range, return the message IDs read."""
+    return [message_id async for message_id, _ in cache.read(channel, low, high, **kwargs)]
+
+
+def test_cover_merges_ranges() -> None:
+    """Merge ranges which overlap or touch, keep the others apart."""
+    lines = ChannelTranscript()
+    lines.cover(10, 20)
+    lines.cover(30, 40)
+    assert lines.covered == [(10, 20), (30, 40)]
+    lines.cover(21, 25)
+    assert lines.covered == [(10, 25), (30, 40)]
+    lines.cover(24, 35)
+    assert lines.covered == [(10, 40)]
+    lines.cover(5, 3)
+    assert lines.covered == [(10, 40)]
+
+
+def test_interval_lookup() -> None:
+    """Find the range containing a message ID, and the ranges around it."""
+    lines = ChannelTranscript()
+    lines.cover(10, 20)
+    lines.cover(30, 40)
+    assert lines.interval(10) == (10, 20)
+    assert lines.interval(20) == (10, 20)
+    assert lines.interval(25) is None
+    assert lines.interval(5) is None
+    assert lines.next_covered(25) == 30
+    assert lines.next_covered(35) is None
+    assert lines.previous_covered(25) == 20
+    assert lines.previous_covered(10) is None
+
+
+def test_uncover_splits_range() -> None:
+    """Split the range covering an uncovered message ID."""
+    lines = ChannelTranscript()
+    lines.cover(10, 20)
+    lines.uncover(15)
+    assert lines.covered == [(10, 14), (16, 20)]
+    lines.uncover(10)
+    assert lines.covered == [(11, 14), (16, 20)]
+    lines.uncover(30)
+    assert lines.covered == [(11, 14), (16, 20)]
+
+
+def test_add_and_remove_lines() -> None:
+    """Keep the IDs sorted and the size up to date."""
+    lines = ChannelTranscript()
+    assert lines.add(20, "abc") == 3
+    assert lines.add(10, "a") == 1
+    assert lines.add(20, "ab") == -1
+    assert lines.ids == [10, 20]
+    assert lines.size == 3
+    assert lines.between(5, 15) == [10]
+    assert lines.remove(20) == -2
+    assert lines.remove(20) == 0
+    assert lines.ids == [10]
+    assert lines.size == 1
+
+
+def test_read_serves_cached_range() -> None:
+    """Fetch a range once, then serve it from the cache in either direction."""
+
+    async def main() -> None:
+        cache = TranscriptCache()
+        channel = FakeChannel([10, 20, 30, 40])
+        assert await collect(cache, channel, 10, 40) == [10, 20, 30, 40]
+        assert channel.fetched == [10, 20, 30, 40]
+
+        channel.fetched.clear()
+        assert await collect(cache, channel, 15, 40) == [20, 30, 40]
+        assert await collect(cache, channel, 10, 40, oldest_first=False) == [40, 30, 20, 10]
+        assert channel.fetched == []
+        assert cache.stats()["served"] == 7
+
+    asyncio.run(main())
+
+
+def test_read_fetches_only_gaps() -> None:
+    """Fetch only the messages in between the cached ranges."""
+
+    async def main() -> None:
+        cache = TranscriptCache()
+        channel = FakeChannel(list(range(10, 101, 10)))
+        await collect(cache, channel, 30, 40)
+        await collect(cache, channel, 70, 80)
+        channel.fetched.clear()
+        channel.histories.clear()
+
+        assert await collect(cache, channel, 10, 100) == list(range(10, 101, 10))
+        assert channel.fetched == [10, 20, 50, 60, 90, 100]
+        assert channel.histories == [(9, 30), (40, 70), (80, 101)]
+        assert cache._channel(channel.id).covered == [(10, 100)]
+
+    asyncio.run(main())
+
+
+def test_read_backwards_fetches_only_gaps() -> None:
+    """Fetch only the gaps when reading newest first too."""
+
+    async def main() -> None:
+        cache = TranscriptCache()
+        channel = FakeChannel(list(range(10, 61, 10)))
+        await collect(cache, channel, 30, 40)
+        channel.fetched.clear()
+
+        assert await collect(cache, channel, 10, 60, oldest_first=False) == [60, 50, 40, 30, 20, 10]
+        assert channel.fetched == [60, 50, 20, 10]
+
+    asyncio.run(main())
+
+
+def test_invalidate_edited_and_deleted() -> None:
+    """Fetch edited messages again, and skip deleted ones without fetching."""
+
+    async def main() -> None:
+        cache = TranscriptCache()
+        channel = FakeChannel([10, 20, 30])
+        await collect(cache, channel, 10, 30)
+
+        channel.messages[20] = channel.message(20, "edited")
+        cache.invalidate(channel.id, [20])
+        del channel.messages[30]
+        cache.invalidate(channel.id, [30], deleted=True)
+        channel.fetched.clear()
+
+        lines = [line async for _, line in cache.read(channel, 10, 30)]
+        assert lines == ["user10: message 10", "user20: edited"]
+        assert channel.fetched == [20]
+        assert cache.size == sum(map(len, lines))
+
+    asyncio.run(main())
+
+
+def test_evicts_least_recently_used_channel() -> None:
+    """Drop the least recently used channel once the cache is full."""
+
+    async def main() -> None:
+        cache = TranscriptCache(max_chars=50)
+        first, second = FakeChannel([10, 20], channel_id=1), FakeChannel([10, 20], channel_id=2)
+        await collect(cache, first, 10, 20)
+        await collect(cache, second, 10, 20)
+        assert cache.stats()["channels"] == 1
+        assert cache.size <= 50
+
+        first.fetched.clear()
+        await collect(cache, first, 10, 20)
+        assert first.fetched == [10, 20]
+
+    asyncio.run(main())
+
+
+@pytest.fixture()
+def cache(monkeypatch: pytest.MonkeyPatch) -> TranscriptCache:
+    """Give `read_history` an empty cache."""
+    cache = TranscriptCache()
+    monkeypatch.setattr(transcript, "transcript_cache", cache)
+    return cache
+
+
+def test_read_history_within_budget(cache: TranscriptCache) -> None:
+    """Read every message of a range within budget, in either order of the endpoints."""
+    channel = FakeChannel([10, 20, 30, 40])
+    history = asyncio.run(read_history(channel, 40, 10, max_messages=10, max_chars=1000))
+    assert history.lines == [f"user{i}: message {i}" for i in (10, 20, 30, 40)]
+    assert (history.start, history.end) == (10, 40)
+    assert not history.sampled
+    assert cache.stats()["fetched"] == 4
+
+
+def test_read_history_samples_long_range(cache: TranscriptCache) -> None:
+    """Keep the oldest and newest messages of a long range, marking the skipped ones."""
+    channel = FakeChannel(list(range(1, 11)))
+    history = asyncio.run(read_history(channel, 1, 10, max_messages=4, max_chars=1000))
+    assert history.lines == [f"user{i}: message {i}" for i in (1, 2, 9, 10)]
+    assert history.gap == 2
+    assert history.text().splitlines()[2] == transcript.GAP
+    assert cache.stats()["fetched"] == 10
+
+
+def test_read_history_truncates_long_line(cache: TranscriptCache) -> None:
+    """Cut the line exceeding the character budget short."""
+    channel = FakeChannel([10, 20])
+    channel.messages[10] = channel.message(10, "x" * 100)
+    history = asyncio.run(read_history(channel, 10, 20, max_messages=10, max_chars=40))
+    assert history.truncated
+    assert sum(map(len, history.lines)) <= 40
+    assert cache.stats()["fetched"] == 2
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from pymongo.errors import PyMongoError
+
+from utils.database import db
+from utils.opentdb import Category, OpenTDBError, opentdb
+
+logger = logging.getLogger("catalogue")
+
+# Served until a snapshot is loaded, so quizzes work even if opentdb and the database are unreachable
+DEFAULT_TOPICS = {
+    "General Knowledge": 9,
+    "Entertainment": {
+        "Books": 10,
+        "Film": 11,
+        "Music": 12,
+        "Musicals & Theatres": 13,
+        "Television": 14,
+        "Video Games": 15,
+        "Board Games": 16,
+        "Comics": 29,
+        "Japanese Anime & Manga": 31,
+        "Cartoon & Animations": 32,
+    },
+    "Science & Nature": 17,
+    "Science": {"Computers": 18, "Mathematics": 19, "Gadgets": 30},
+    "Mythology": 20,
+    "Sports": 21,
+    "Geography": 22,
+    "History": 23,
+    "Politics": 24,
+    "Art": 25,
+    "Celebrities": 26,
+    "Animals": 27,
+    "Vehicles": 28,
+}
+
+
+def structure_categories(raw_categories: list[Category]) -> dict:
+    """Create structured categories.
+
+    Note that the returned instance is a defaultdict.
+
+    Parameters
+    ----------
+    raw_categories : list[Category]
+        Categories as returned by `OpenTDB.categories`.
+
+    Returns
+    -------
+    A dictionary structuring all categories.
+
+    """
+    structured_categories = defaultdict(dict)
+
+    for category in raw_categories:
+        topic: str = category["name"]
+        id = category["id"]
+
+        if ":" in topic:
+            topic, subtopic = topic.split(": ")
+            structured_categories[topic][subtopic] = id
+        else:
+            structured_categories[topic] = id
+
+    return structured_categories
+
+
+class CategoryCatalogue:
+    """In-memory catalogue of opentdb categories.
+
+    The catalogue is loaded once from the snapshot persisted in the database
+    and refreshed from opentdb in the background whenever it gets older than
+    `ttl`, so that lookups never touch the network.
+
+    Parameters
+    ----------
+    ttl : float, optional
+        Seconds after which the catalogue is refreshed (default is one day).
+    retry_delay : float, optional
+        Seconds to wait before retrying a failed refresh (default is 10 minutes).
+
+    Attributes
+    ----------
+    topics : dict
+        The structured categories, as returned by `structure_categories`.
+    updated_at : float
+        UNIX timestamp of the last fetch from opentdb, 0 if never fetched.
+
+    """
+
+    def __init__(self, ttl: float = 24 * 60 * 60, retry_delay: float = 10 * 60) -> None:
+        self.ttl = ttl
+        self.retry_delay = retry_delay
+        self.topics: dict = defaultdict(dict, DEFAULT_TOPICS)
+        self.updated_at = 0.0
+        self._loaded = False
+        self._refresh_task: asyncio.Task | None = None
+
+    def _apply(self, raw_categories: list[Category], updated_at: float) -> None:
+        """Replace the catalogue's topics."""
+        if topics := structure_categories(raw_categories):
+            self.topics = topics
+            self.updated_at = updated_at
+
+    def topic_ids(self) -> list[int]:
+        """Return the IDs of all topics that have no subtopic, and of all subtopics."""
+        return [
+            id for value in self.topics.values() for id in (value.values() if isinstance(value, dict) else [value])
+        ]
+
+    def is_stale(self) -> bool:
+        """Whether the catalogue is older than its TTL."""
+        return time.time() - self.updated_at >= self.ttl
+
+    async def load(self) -> None:
+        """Load the persisted snapshot and start refreshing in the background.
+
+        Calling this again, e.g. on a cog reload, does not reload anything.
+        """
+        if not self._loaded:
+            try:
+                if snapshot := await db.get_categories_snapshot():
+                    self._apply(snapshot["categories"], snapshot["updated_at"])
+            except PyMongoError:
+                logger.exception("Could not load the category snapshot.")
+            self._loaded = True
+
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def refresh(self) -> None:
+        """Fetch the categories from opentdb and persist them."""
+        raw_categories = await opentdb.categories()
+        updated_at = time.time()
+        self._apply(raw_categories, updated_at)
+        await db.set_categories_snapshot(raw_categories, updated_at)
+        logger.info("Refreshed %d quiz categories.", len(raw_categories))
+
+    async def _refresh_loop(self) -> None:
+        """Keep the catalogue fresh."""
+        while True:
+            if self.is_stale():
+                try:
+                    await self.refresh()
+                except (OpenTDBError, PyMongoError):
+                    logger.warning("Could not refresh quiz categories, retrying later.")
+                    await asyncio.sleep(self.retry_delay)
+                    continue
+
+            await asyncio.sleep(self.updated_at + self.ttl - time.time())
+
+
+catalogue = CategoryCatalogue()
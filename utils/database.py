@@ -1,11 +1,86 @@
 import logging
 import os
+from datetime import UTC, datetime
 from typing import Any
 
 import motor.motor_asyncio
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
 
 logger = logging.getLogger("db")
 
+# Seconds after which entries of the cache-like collections expire
+COMMAND_CACHE_TTL = 60 * 60
+SHORTIFY_CACHE_TTL = 24 * 60 * 60
+
+# Indexes per collection, along with the query shapes they serve
+INDEXES: dict[str, list[tuple[IndexModel, str]]] = {
+    "scores": [
+        (
+            IndexModel([("user_id", ASCENDING), ("server_id", ASCENDING)], unique=True),
+            "get_score, set_score, increment_scores: {user_id, server_id}",
+        ),
+        (
+            IndexModel([("server_id", ASCENDING), ("score", DESCENDING)]),
+            "get_leaderboard: {server_id} sorted by score descending",
+        ),
+    ],
+    "commands_cache": [
+        (
+            IndexModel([("command_name", ASCENDING), ("channel_id", ASCENDING)], unique=True),
+            "claim_command, set_command_inactive: {command_name, channel_id}",
+        ),
+        (
+            IndexModel("updated_at", expireAfterSeconds=COMMAND_CACHE_TTL),
+            "TTL: expires commands left active by a crash",
+        ),
+    ],
+    "quiz_tokens": [
+        (
+            IndexModel("server_id", unique=True),
+            "get_token, change_token, get_seen_questions, add_seen_questions: {server_id}",
+        ),
+    ],
+    "shortify_cache": [
+        (
+            IndexModel([("user_id", ASCENDING), ("channel_id", ASCENDING)], unique=True),
+            "get_shortify_cache, set_shortify_cache: {user_id, channel_id}",
+        ),
+        (
+            IndexModel("created_at", expireAfterSeconds=SHORTIFY_CACHE_TTL),
+            "TTL: expires abandoned shortify selections",
+        ),
+    ],
+    "learn_more_cache": [
+        (
+            IndexModel("question", unique=True),
+            "get_learn_more_url, set_learn_more_url: {question}",
+        ),
+    ],
+    "gemini_cache": [
+        (
+            IndexModel("key", unique=True),
+            "get_gemini_response, set_gemini_response: {key}",
+        ),
+        (
+            IndexModel("expires_at", expireAfterSeconds=0),
+            "TTL: expires responses at their template's TTL",
+        ),
+    ],
+    "question_bank": [
+        (
+            IndexModel("hash", unique=True),
+            "add_questions: {hash}",
+        ),
+        (
+            IndexModel([("category_id", ASCENDING), ("difficulty", ASCENDING), ("type", ASCENDING)]),
+            "sample_questions, count_questions: {category_id, difficulty?, type?}",
+        ),
+    ],
+}
+# Collections whose indexes guarantee correctness rather than speed, startup fails without them
+REQUIRED_INDEXES = {"commands_cache"}
+
 
 class Database:
     """Database class. Manages a `AsyncIOMotorClient` internally.
@@ -21,7 +96,7 @@ class Database:
     ----------
     db
         An `AsyncIOMotorDatabase` database client instance.
-    scores, command_cache
+    scores, commands_cache, quiz_tokens, shortify_cache, quiz_categories, question_bank, learn_more_cache, gemini_cache
         `AsyncIOMotorCollection` collection client instances.
 
     """
@@ -34,9 +109,46 @@ class Database:
         self.commands_cache = self.db["commands_cache"]
         self.quiz_tokens = self.db["quiz_tokens"]
         self.shortify_cache = self.db["shortify_cache"]
+        self.quiz_categories = self.db["quiz_categories"]
+        self.question_bank = self.db["question_bank"]
+        self.learn_more_cache = self.db["learn_more_cache"]
+        self.gemini_cache = self.db["gemini_cache"]
 
         logger.info("Connected to MongoDB database.")
 
+    async def ensure_indexes(self) -> dict[str, list[str]]:
+        """Create the indexes listed in `INDEXES`.
+
+        Existing indexes are left untouched, so this is safe to run on every
+        startup. A collection whose indexes cannot be created is logged and
+        skipped, unless it is listed in `REQUIRED_INDEXES`.
+
+        Returns
+        -------
+        dict[str, list[str]]
+            Names of the indexes per collection.
+
+        Raises
+        ------
+        PyMongoError
+            If the indexes of a collection in `REQUIRED_INDEXES` could not be created.
+
+        """
+        report = {}
+        for collection, indexes in INDEXES.items():
+            try:
+                names = await self.db[collection].create_indexes([index for index, _ in indexes])
+            except PyMongoError:
+                if collection in REQUIRED_INDEXES:
+                    raise
+                logger.exception("Could not create the indexes of %s.", collection)
+                continue
+
+            report[collection] = names
+            for name, (_, serves) in zip(names, indexes, strict=True):
+                logger.info("Index %s.%s serves %s", collection, name, serves)
+        return report
+
     async def get_score(self, user_id: int, server_id: int) -> int:
         """Get the score of a user.
 
@@ -77,6 +189,41 @@ class Database:
             upsert=True,
         )
 
+    async def increment_scores(self, server_id: int, deltas: dict[int, int]) -> dict[int, int]:
+        """Increment the scores of several users at once.
+
+        All increments are applied atomically per user in a single bulk write,
+        so concurrent quizzes cannot lose points.
+
+        Parameters
+        ----------
+        server_id : int
+            A Discord Server ID.
+        deltas : dict[int, int]
+            Discord User IDs and the points to add to their scores.
+
+        Returns
+        -------
+        dict[int, int]
+            Discord User IDs and their new scores.
+
+        """
+        if not deltas:
+            return {}
+
+        await self.scores.bulk_write(
+            [
+                UpdateOne({"user_id": user_id, "server_id": server_id}, {"$inc": {"score": delta}}, upsert=True)
+                for user_id, delta in deltas.items()
+            ],
+            ordered=False,
+        )
+        totals = self.scores.find(
+            {"server_id": server_id, "user_id": {"$in": list(deltas)}},
+            {"_id": 0, "user_id": 1, "score": 1},
+        )
+        return {document["user_id"]: document["score"] async for document in totals}
+
     async def get_leaderboard(self, server_id: int, limit: int = 5) -> dict:
         """Return the highest scoring users in server."""
         top_users = self.scores.find({"server_id": server_id}).sort("score", -1).limit(limit)
@@ -87,43 +234,34 @@ class Database:
             leaderboard[user_id] = score
         return leaderboard
 
-    async def command_is_active(self, command_name: str, channel_id: int) -> bool:
-        """Check if a command is active.
+    async def claim_command(self, command_name: str, channel_id: int) -> bool:
+        """Atomically set a command as active, unless it already is.
+
+        Relies on the unique (command_name, channel_id) index, which startup requires: claiming a command
+        that is already active fails the upsert with a duplicate key error.
 
         Parameters
         ----------
         command_name : str
             Name of the command.
         channel_id : int
-            A Discord Channel ID.
+            ID of the Discord Channel where the command should be registered active.
 
         Returns
         -------
         bool
-            Whether or not the command is active on said channel.
+            Whether the command was claimed.
 
         """
-        command = await self.commands_cache.find_one(
-            {"command_name": command_name, "channel_id": channel_id},
-        )
-        return command["active"] if command else False
-
-    async def set_command_active(self, command_name: str, channel_id: int) -> None:
-        """Set a command as active.
-
-        Parameters
-        ----------
-        command_name : str
-            Name of the command.
-        channel_id : int
-            ID of the Discord Channel where the command should be registered active.
-
-        """
-        await self.commands_cache.update_one(
-            {"command_name": command_name, "channel_id": channel_id},
-            {"$set": {"active": True}},
-            upsert=True,
-        )
+        try:
+            await self.commands_cache.find_one_and_update(
+                {"command_name": command_name, "channel_id": channel_id, "active": {"$ne": True}},
+                {"$set": {"active": True, "updated_at": datetime.now(UTC)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
 
     async def set_command_inactive(self, command_name: str, channel_id: int) -> None:
         """Set a command as inactive.
@@ -138,7 +276,7 @@ class Database:
         """
         await self.commands_cache.update_one(
             {"command_name": command_name, "channel_id": channel_id},
-            {"$set": {"active": False}},
+            {"$set": {"active": False, "updated_at": datetime.now(UTC)}},
             upsert=True,
         )
 
@@ -160,6 +298,178 @@ class Database:
             upsert=True,
         )
 
+    async def get_seen_questions(self, server_id: int) -> list[str]:
+        """Return the content hashes of the questions recently asked in a server."""
+        if result := await self.quiz_tokens.find_one({"server_id": server_id}, {"seen_questions": 1}):
+            return result.get("seen_questions", [])
+        return []
+
+    async def add_seen_questions(self, server_id: int, hashes: list[str], limit: int = 1000) -> None:
+        """Register questions as asked in a server.
+
+        Parameters
+        ----------
+        server_id : int
+            A Discord Server ID.
+        hashes : list[str]
+            Content hashes of the asked questions.
+        limit : int, optional
+            Number of most recent questions to remember (default is 1000).
+
+        """
+        await self.quiz_tokens.update_one(
+            {"server_id": server_id},
+            {"$push": {"seen_questions": {"$each": hashes, "$slice": -limit}}},
+            upsert=True,
+        )
+
+    async def add_questions(self, questions: list[dict]) -> int:
+        """Insert questions into the question bank, skipping known ones.
+
+        Parameters
+        ----------
+        questions : list[dict]
+            Questions as normalized by `utils.question_bank.bank_document`.
+
+        Returns
+        -------
+        int
+            Number of questions that were new to the bank.
+
+        """
+        if not questions:
+            return 0
+        result = await self.question_bank.bulk_write(
+            [
+                UpdateOne(
+                    {"hash": question["hash"]},
+                    {"$setOnInsert": {key: value for key, value in question.items() if key != "hash"}},
+                    upsert=True,
+                )
+                for question in questions
+            ],
+            ordered=False,
+        )
+        return result.upserted_count
+
+    async def sample_questions(
+        self,
+        amount: int,
+        category_id: int | None = None,
+        difficulty: str | None = None,
+        type: str | None = None,
+        exclude: list[str] | None = None,
+    ) -> list[dict]:
+        """Return random questions from the question bank.
+
+        Parameters
+        ----------
+        amount : int
+            Maximum number of questions.
+        category_id : int | None, optional
+            Optionally specified opentdb category ID. Defaults to None.
+        difficulty : str | None, optional
+            Optionally specified difficulty. Defaults to None.
+        type : str | None, optional
+            Optionally specified question type. Defaults to None.
+        exclude : list[str] | None, optional
+            Content hashes of questions to leave out. Defaults to None.
+
+        Returns
+        -------
+        list[dict]
+            Up to *amount* questions.
+
+        """
+        query = {"category_id": category_id, "difficulty": difficulty, "type": type}
+        query = {key: value for key, value in query.items() if value}
+        if exclude:
+            query["hash"] = {"$nin": exclude}
+
+        cursor = self.question_bank.aggregate(
+            [{"$match": query}, {"$sample": {"size": amount}}, {"$project": {"_id": 0}}],
+        )
+        return await cursor.to_list(length=amount)
+
+    async def count_questions(self, category_id: int) -> int:
+        """Return the number of banked questions in a category."""
+        return await self.question_bank.count_documents({"category_id": category_id})
+
+    async def get_learn_more_url(self, question: str) -> str | None:
+        """Return the cached Learn more URL of a question, if any."""
+        if result := await self.learn_more_cache.find_one({"question": question}):
+            return result.get("url")
+        return None
+
+    async def set_learn_more_url(self, question: str, url: str) -> None:
+        """Cache the Learn more URL of a question."""
+        await self.learn_more_cache.update_one(
+            {"question": question},
+            {"$set": {"url": url}},
+            upsert=True,
+        )
+
+    async def get_gemini_response(self, key: str) -> dict | None:
+        """Return the cached Gemini response with that key, unless it expired.
+
+        Returns
+        -------
+        dict | None
+            A document with keys response and expires_at (UTC datetime).
+
+        """
+        return await self.gemini_cache.find_one({"key": key, "expires_at": {"$gt": datetime.now(UTC)}})
+
+    async def set_gemini_response(self, key: str, template: str, response: str, expires_at: datetime) -> None:
+        """Cache a Gemini response.
+
+        Parameters
+        ----------
+        key : str
+            Hash of the template and its normalized input.
+        template : str
+            Name of the prompt template.
+        response : str
+            The response text.
+        expires_at : datetime
+            Time after which the response is dropped.
+
+        """
+        await self.gemini_cache.update_one(
+            {"key": key},
+            {"$set": {"template": template, "response": response, "expires_at": expires_at}},
+            upsert=True,
+        )
+
+    async def get_categories_snapshot(self) -> dict | None:
+        """Return the persisted opentdb category snapshot, if any.
+
+        Returns
+        -------
+        dict | None
+            A document with keys categories (raw opentdb categories)
+            and updated_at (UNIX timestamp of the fetch).
+
+        """
+        return await self.quiz_categories.find_one({"_id": "opentdb"})
+
+    async def set_categories_snapshot(self, categories: list, updated_at: float) -> None:
+        """Persist the opentdb category snapshot.
+
+        Parameters
+        ----------
+        categories : list
+            Raw categories as returned by `OpenTDB.categories`.
+        updated_at : float
+            UNIX timestamp of the fetch.
+
+        """
+        await self.quiz_categories.update_one(
+            {"_id": "opentdb"},
+            {"$set": {"categories": categories, "updated_at": updated_at}},
+            upsert=True,
+        )
+
     async def get_shortify_cache(self, user_id: int, channel_id: int) -> dict:
         """Get shortify cache."""
         return await self.shortify_cache.find_one({"user_id": user_id, "channel_id": channel_id})
@@ -172,7 +482,7 @@ class Database:
             return sorted([old_cache["message_id"], message_id])
 
         await self.shortify_cache.insert_one(
-            {"user_id": user_id, "channel_id": channel_id, "message_id": message_id},
+            {"user_id": user_id, "channel_id": channel_id, "message_id": message_id, "created_at": datetime.now(UTC)},
         )
         return None
 
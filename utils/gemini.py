@@ -1,12 +1,25 @@
+import hashlib
 import json
+import logging
 import os
+import time
 import traceback
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass
+from datetime import UTC, datetime
 
 import google.generativeai as genai
 from dotenv import load_dotenv
+from google.api_core.exceptions import ResourceExhausted
 from google.generativeai.types import HarmBlockThreshold, HarmCategory, generation_types
+from pymongo.errors import PyMongoError
+
+from utils.database import db
+from utils.scheduler import Priority, RequestScheduler
 
 load_dotenv()
+logger = logging.getLogger("gemini")
 
 genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
 
@@ -31,6 +44,208 @@ summary_template = """Summarize the conversation below:
 name_fact = """
 Given a username: {name}. Come up with 1 fun fact about this name. If no fun fact can be made, just say False."""
 
+falsify_template = """
+Facts:
+{facts}
+
+For each fact above, write a false statement for a True False quiz. Change a single detail so that the statement becomes wrong but stays plausible, and keep the wording and length close to the original. Answer directly and only the false statements.
+
+Using this JSON schema:
+    Statement = {{"index": int, "false_statement": str}}
+Return a `list[Statement]`, one per fact.
+"""  # noqa: E501
+
+
+class GeminiError(Exception):
+    """The response could not be used."""
+
+
+class GeminiBusyError(GeminiError):
+    """The quota was used up, even after retrying."""
+
+
+def is_message(message: object) -> bool:
+    """Check that an element of a conversation is a message."""
+    return (
+        isinstance(message, dict)
+        and isinstance(message.get("userid"), int)
+        and isinstance(message.get("message"), str)
+    )
+
+
+def is_conversation(response: str) -> bool:
+    """Check that a response is a list holding at least one message."""
+    messages = json.loads(response)
+    return isinstance(messages, list) and any(map(is_message, messages))
+
+
+def is_statements(response: str) -> bool:
+    """Check that a response is a list of false statements."""
+    statements = json.loads(response)
+    return isinstance(statements, list) and all(
+        isinstance(statement, dict)
+        and isinstance(statement.get("index"), int)
+        and isinstance(statement.get("false_statement"), str)
+        for statement in statements
+    )
+
+
+def has_string(name: str) -> Callable[[str], bool]:
+    """Return a check that a response is an object with a string member."""
+
+    def check(response: str) -> bool:
+        data = json.loads(response)
+        return isinstance(data, dict) and isinstance(data.get(name), str)
+
+    return check
+
+
+@dataclass(frozen=True)
+class Template:
+    """A prompt template and how its responses are cached.
+
+    Attributes
+    ----------
+    name : str
+        Name of the template, part of the cache key.
+    text : str
+        The prompt, with a single replacement field.
+    field : str
+        Name of the replacement field.
+    ttl : float
+        Seconds a response is cached for.
+    casefold : bool
+        Whether inputs differing only in case share responses.
+    priority : Priority
+        Scheduling priority of its requests, unless overridden per request.
+    check : Callable[[str], bool] | None
+        Whether a response can be used, only those which can are cached.
+
+    """
+
+    name: str
+    text: str
+    field: str
+    ttl: float
+    casefold: bool = False
+    priority: Priority = Priority.NORMAL
+    check: Callable[[str], bool] | None = None
+
+    def format(self, value: str) -> str:
+        """Return the prompt for an input."""
+        return self.text.format(**{self.field: value})
+
+    def key(self, value: str) -> str:
+        """Return the cache key of an input, a hash of the template name and the normalized input."""
+        value = " ".join(value.split())
+        if self.casefold:
+            value = value.casefold()
+        return hashlib.sha256(f"{self.name}\n{value}".encode()).hexdigest()
+
+    def accepts(self, response: str) -> bool:
+        """Check a response with `check`, if there is one."""
+        if self.check is None:
+            return True
+        try:
+            return self.check(response)
+        except ValueError:
+            return False
+
+
+CONVERSATION = Template(
+    "conversation",
+    convo_template,
+    "topic",
+    ttl=60 * 60,
+    casefold=True,
+    priority=Priority.INTERACTIVE,
+    check=is_conversation,
+)
+SUMMARY = Template(
+    "summary",
+    summary_template,
+    "text",
+    ttl=24 * 60 * 60,
+    priority=Priority.INTERACTIVE,
+    check=has_string("summary"),
+)
+NAME_FACT = Template(
+    "name_fact",
+    name_fact,
+    "name",
+    ttl=7 * 24 * 60 * 60,
+    casefold=True,
+    priority=Priority.INTERACTIVE,
+    check=has_string("fun_fact"),
+)
+FALSIFY = Template("falsify", falsify_template, "facts", ttl=7 * 24 * 60 * 60, check=is_statements)
+
+
+class ResponseCache:
+    """Two tier cache of Gemini responses, keyed by template and normalized input.
+
+    Recently used responses are kept in memory, least recently used first out,
+    in front of the gemini_cache collection, where every response expires at
+    its template's TTL. Database errors are logged and treated as misses.
+
+    Parameters
+    ----------
+    max_items : int, optional
+        Number of responses kept in memory (default is 1024).
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of lookups served from and not served from the cache.
+
+    """
+
+    def __init__(self, max_items: int = 1024) -> None:
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+
+    async def get(self, key: str) -> str | None:
+        """Return the cached response, None if there is none."""
+        if (entry := self._memory.get(key)) and entry[0] > time.time():
+            self.hits += 1
+            self._memory.move_to_end(key)
+            return entry[1]
+
+        try:
+            document = await db.get_gemini_response(key)
+        except PyMongoError:
+            logger.warning("Could not read the cached Gemini response.", exc_info=True)
+            document = None
+        if document is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._remember(key, document["expires_at"].replace(tzinfo=UTC).timestamp(), document["response"])
+        return document["response"]
+
+    async def set(self, key: str, template: Template, response: str) -> None:
+        """Cache a response for the template's TTL."""
+        expires_at = time.time() + template.ttl
+        self._remember(key, expires_at, response)
+        try:
+            await db.set_gemini_response(key, template.name, response, datetime.fromtimestamp(expires_at, UTC))
+        except PyMongoError:
+            logger.warning("Could not cache the Gemini response.", exc_info=True)
+
+    def stats(self) -> dict[str, int]:
+        """Return the cache's hit and miss counters and the number of responses in memory."""
+        return {"hits": self.hits, "misses": self.misses, "memory": len(self._memory)}
+
+    def _remember(self, key: str, expires_at: float, response: str) -> None:
+        """Keep a response in memory, evicting the least recently used one if full."""
+        self._memory[key] = (expires_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
 
 class Gemini:
     """Gemini API Client.
@@ -43,6 +258,11 @@ class Gemini:
         Safety configs defined as `HarmCategory`, `HarmBlockThreshold` pairings.
     finish_errors : dict
         Error messages and their descriptions.
+    cache : ResponseCache
+        Cache of the successful responses.
+    scheduler : RequestScheduler
+        Admission control keeping requests within the quota, set by the
+        GEMINI_RPM (default 15) and GEMINI_CONCURRENCY (default 4) environment variables.
 
     """
 
@@ -66,6 +286,12 @@ class Gemini:
             generation_config={"response_mime_type": "application/json"},
             safety_settings=self.safety_settings,
         )
+        self.cache = ResponseCache()
+        self.scheduler = RequestScheduler(
+            rate=float(os.getenv("GEMINI_RPM", "15")),
+            concurrency=int(os.getenv("GEMINI_CONCURRENCY", "4")),
+            retry_on=(ResourceExhausted,),
+        )
 
     async def generate_conversation(self, prompt: str) -> str:
         """Generate a conversation based on the given topic.
@@ -81,11 +307,24 @@ class Gemini:
             The conversation.
 
         """
-        response = await self.model.generate_content_async(
-            convo_template.format(topic=prompt),
-        )
+        return await self.generate(CONVERSATION, prompt)
 
-        return await self.verify(response)
+    def stream_conversation(self, prompt: str) -> AsyncIterator[str]:
+        """Stream a conversation based on the given topic, see `stream`.
+
+        Parameters
+        ----------
+        prompt : str
+            A humane description of the conversation topic.
+
+        Returns
+        -------
+        AsyncIterator[str]
+            The response received so far after every chunk, the
+            last one being the complete response.
+
+        """
+        return self.stream(CONVERSATION, prompt)
 
     async def summarize_conversation(self, text: str) -> str:
         """Return a summary of the conversation.
@@ -101,17 +340,183 @@ class Gemini:
             A summary of the conversation.
 
         """
-        response = await self.model.generate_content_async(
-            summary_template.format(text=text),
-        )
-        return await self.verify(response)
+        return await self.generate(SUMMARY, text)
+
+    def stream_summary(self, text: str) -> AsyncIterator[str]:
+        """Stream a summary of the conversation, see `stream`.
+
+        Parameters
+        ----------
+        text : str
+            Conversation to summarize.
+
+        Returns
+        -------
+        AsyncIterator[str]
+            The response received so far after every chunk, the
+            last one being the complete response.
+
+        """
+        return self.stream(SUMMARY, text)
 
     async def name_fun_fact(self, name: str) -> str:
         """Give a fun fact about username, if nothing found, return False."""
-        response = await self.model.generate_content_async(
-            name_fact.format(name=name),
-        )
-        return await self.verify(response)
+        return await self.generate(NAME_FACT, name)
+
+    async def falsify_facts(self, facts: list[str], priority: Priority | None = None) -> dict[str, str]:
+        """Create false statements based on true facts, all in one request.
+
+        Parameters
+        ----------
+        facts : list[str]
+            The true facts.
+        priority : Priority, optional
+            Scheduling priority of the request (default is the template's).
+
+        Returns
+        -------
+        dict[str, str]
+            The facts and their falsified versions. Facts the response
+            has no false statement for are left out.
+
+        Raises
+        ------
+        GeminiError
+            If the response is not a list of statements.
+
+        """
+        numbered = "\n".join(f"{index}. {fact}" for index, fact in enumerate(facts))
+        try:
+            statements = json.loads(await self.generate(FALSIFY, numbered, priority))
+            return {
+                facts[statement["index"]]: statement["false_statement"].strip()
+                for statement in statements
+                if 0 <= statement["index"] < len(facts) and statement["false_statement"].strip()
+            }
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            msg = "Gemini did not return a list of false statements."
+            raise GeminiError(msg) from e
+
+    async def generate(self, template: Template, value: str, priority: Priority | None = None) -> str:
+        """Return the verified response to a prompt, from the cache if it was answered before.
+
+        Requests go through `scheduler`, so identical prompts asked at the same
+        time share one request. Blocked and unfinished responses, and those the
+        template does not accept, are returned but not cached.
+
+        Parameters
+        ----------
+        template : Template
+            The prompt template.
+        value : str
+            Input to fill the template with.
+        priority : Priority, optional
+            Scheduling priority of the request (default is the template's).
+
+        Returns
+        -------
+        str
+            The response, as returned by `verify`.
+
+        Raises
+        ------
+        GeminiBusyError
+            If the request was still rate limited after the scheduler's retries.
+
+        """
+        key = template.key(value)
+        if (cached := await self.cache.get(key)) is not None and template.accepts(cached):
+            return cached
+
+        try:
+            return await self.scheduler.submit(
+                key,
+                lambda: self._request(key, template, value),
+                template.priority if priority is None else priority,
+            )
+        except ResourceExhausted as e:
+            msg = "Gemini is busy, try again later."
+            raise GeminiBusyError(msg) from e
+
+    async def _request(self, key: str, template: Template, value: str) -> str:
+        """Request a response and cache it if it succeeded."""
+        response = await self.model.generate_content_async(template.format(value))
+        text = await self.verify(response)
+        if self.succeeded(response) and template.accepts(text):
+            await self.cache.set(key, template, text)
+        return text
+
+    async def stream(self, template: Template, value: str, priority: Priority | None = None) -> AsyncIterator[str]:
+        """Stream the response to a prompt as it is generated, or the cached response if it was answered before.
+
+        The request holds a `scheduler` slot until the response starts, the
+        chunks are read without one, so a slow consumer does not hold other
+        requests up. The partial responses are not verified, the last one is the response as returned by
+        `verify`. Blocked and unfinished responses, and those the template does
+        not accept, are not cached.
+
+        Parameters
+        ----------
+        template : Template
+            The prompt template.
+        value : str
+            Input to fill the template with.
+        priority : Priority, optional
+            Scheduling priority of the request (default is the template's).
+
+        Yields
+        ------
+        str
+            The response received so far.
+
+        Raises
+        ------
+        GeminiBusyError
+            If the request was still rate limited after the scheduler's retries.
+
+        """
+        key = template.key(value)
+        if (cached := await self.cache.get(key)) is not None and template.accepts(cached):
+            yield cached
+            return
+
+        try:
+            response = await self.scheduler.run(
+                lambda: self.model.generate_content_async(template.format(value), stream=True),
+                template.priority if priority is None else priority,
+            )
+        except ResourceExhausted as e:
+            msg = "Gemini is busy, try again later."
+            raise GeminiBusyError(msg) from e
+
+        text = ""
+        try:
+            async for chunk in response:
+                text += chunk.text
+                yield text
+        except (generation_types.BlockedPromptException, ValueError):
+            # Blocked or cut short, reported by `verify`
+            logger.info("Stopped streaming a %s response.", template.name)
+
+        text = await self.verify(response)
+        if self.succeeded(response) and template.accepts(text):
+            await self.cache.set(key, template, text)
+        yield text
+
+    @staticmethod
+    def succeeded(response: generation_types.AsyncGenerateContentResponse) -> bool:
+        """Check that a response was neither blocked nor cut short, and has text."""
+        if (
+            response.prompt_feedback.block_reason
+            or not response.candidates
+            or response.candidates[0].finish_reason.name != "STOP"
+        ):
+            return False
+        try:
+            response.text  # noqa: B018
+        except Exception:
+            return False
+        return True
 
     async def verify(self, response: generation_types.AsyncGenerateContentResponse) -> str:
         """Verify the content of the output and return a valid response.
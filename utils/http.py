@@ -0,0 +1,54 @@
+import logging
+
+import aiohttp
+
+logger = logging.getLogger("http")
+
+
+class HTTPClient:
+    """Owner of the long-lived `aiohttp.ClientSession` shared by the bot's API clients.
+
+    The session is created lazily, because it has to be bound to the running
+    event loop, and is reused for every request so that connections are pooled
+    and kept alive between calls.
+
+    Parameters
+    ----------
+    limit : int
+        Maximum number of simultaneous connections.
+    limit_per_host : int
+        Maximum number of simultaneous connections to a single host.
+    keepalive_timeout : float
+        Seconds an idle connection is kept open for reuse.
+
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 10, keepalive_timeout: float = 30) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Return the shared session, creating it on first use."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+            logger.info("Opened shared HTTP session.")
+        return self._session
+
+    async def close(self) -> None:
+        """Close the shared session and release its pooled connections."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("Closed shared HTTP session.")
+        self._session = None
+
+
+http_client = HTTPClient()
@@ -0,0 +1,123 @@
+import contextlib
+import json
+import re
+from typing import Any
+
+# Characters of a JSON string up to its closing quote, stopping before an escape that was not fully
+# received yet. High surrogates are only taken together with their low surrogate.
+STRING_BODY = re.compile(
+    r'(?:[^"\\]|\\["\\/bfnrt]|\\u(?![dD][89abAB])[0-9a-fA-F]{4}|\\u[dD][89abAB][0-9a-fA-F]{2}\\u[dD][c-fC-F][0-9a-fA-F]{2})*',
+)
+
+
+def partial_string(text: str, key: str) -> str | None:
+    """Return the value of a string member of a JSON object that is still being received.
+
+    Parameters
+    ----------
+    text : str
+        The beginning of a JSON object.
+    key : str
+        Name of the member.
+
+    Returns
+    -------
+    str | None
+        The decoded part of the value received so far, None if
+        the value has not started yet.
+
+    """
+    if not (match := re.search(rf'"{re.escape(key)}"\s*:\s*"', text)):
+        return None
+    body = STRING_BODY.match(text, match.end()).group()
+    # Models sometimes put raw control characters, e.g. newlines, into strings
+    return json.loads(f'"{body}"', strict=False)
+
+
+# Characters that change the parser's state outside and inside strings, everything in between is skipped
+STRUCTURE = re.compile(r'["\[\]{},]')
+STRING_STRUCTURE = re.compile(r'["\\]')
+
+
+class ArrayParser:
+    """Parse the elements of a JSON array while it is still being received.
+
+    Only the text received since the previous call is scanned, jumping from
+    one structural character to the next. Object and array elements are
+    returned as soon as they are closed, other elements once the separator
+    after them arrives. Elements which are not valid JSON are skipped.
+
+    Attributes
+    ----------
+    done : bool
+        Whether the array was closed, or the text turned out not to be an array.
+
+    """
+
+    def __init__(self) -> None:
+        self.done = False
+        self._text = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        # Start of the element being received, None once it was returned
+        self._element: int | None = None
+
+    def feed(self, text: str) -> list[Any]:
+        """Take the text received so far, which extends the previous text, and return the elements it completes."""
+        if text[: len(self._text)] != self._text:
+            self.done = True
+        if self.done:
+            return []
+        self._text = text
+
+        elements = []
+        position = self._position
+        while not self.done:
+            pattern = STRING_STRUCTURE if self._in_string else STRUCTURE
+            if (match := pattern.search(text, position)) is None:
+                position = len(text)
+                break
+            char, position = match.group(), match.end()
+            if char == "\\":
+                if position == len(text):
+                    # Scan the escape again once it was received
+                    position = match.start()
+                    break
+                position += 1
+            elif char == '"':
+                self._in_string = not self._in_string
+            else:
+                self._structure(elements, char, match.start())
+        self._position = position
+        return elements
+
+    def _structure(self, elements: list[Any], char: str, index: int) -> None:
+        """Track a bracket or separator outside strings, adding the element it completes."""
+        if char in "[{":
+            if self._depth == 0:
+                self.done = char == "{"
+                self._element = index + 1
+            self._depth += 1
+        elif char in "]}":
+            self._depth -= 1
+            if self._depth == 1 and self._element is not None:
+                self._add(elements, self._text[self._element : index + 1])
+                self._element = None
+            elif self._depth == 0:
+                self._add_scalar(elements, index)
+                self.done = True
+        elif self._depth == 1:
+            self._add_scalar(elements, index)
+            self._element = index + 1
+
+    def _add_scalar(self, elements: list[Any], end: int) -> None:
+        """Add the element ending at a separator, unless it was added already."""
+        if self._element is not None and (segment := self._text[self._element : end].strip()):
+            self._add(elements, segment)
+
+    @staticmethod
+    def _add(elements: list[Any], segment: str) -> None:
+        """Add an element, skipping it if it is not valid JSON."""
+        with contextlib.suppress(ValueError):
+            elements.append(json.loads(segment))
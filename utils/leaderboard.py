@@ -1,12 +1,20 @@
+import asyncio
+import contextlib
+import functools
 import io
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import aiohttp
 import discord
-import PIL
-from PIL import Image
 import PIL.ImageDraw
 import PIL.ImageFont
+from PIL import Image
+
+from utils.http import http_client
+from utils.members import ResolvedMember
 
 BASE_PATH = Path(__file__).parent.parent
 ASSETS_PATH = BASE_PATH / "assets"
@@ -16,67 +24,211 @@ CACHE_PATH = BASE_PATH / ".cache"
 # create a cache path if it doesn't exist
 CACHE_PATH.mkdir(exist_ok=True)
 
+AVATAR_SIZE = 50
+
+# Renders off the event loop. A single worker, since the cached FreeType font must not be used by two threads at once
+render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="leaderboard")
+
+
+@functools.cache
+def load_assets() -> tuple[PIL.ImageFont.FreeTypeFont, Image.Image]:
+    """Load the leaderboard font and background once.
+
+    Returns
+    -------
+    tuple[FreeTypeFont, Image]
+        The font and the decoded background image, which must not be drawn on.
+
+    """
+    font = PIL.ImageFont.truetype(FONTS_PATH / "Montserrat-Medium.ttf", 24)
+    with Image.open(LEADERBOARD_PATH / "quiz-leaderboard.png") as background:
+        background.load()
+        return font, background.copy()
+
 
-async def generate_quiz_leaderboard_image(
-    leaderboard_data: list[tuple[discord.Member, int, int]],
-) -> Image.Image | None:
-    """Generate a quiz leaderboard image."""
-    base_font_path = FONTS_PATH / "Montserrat-Medium.ttf"
-    font = PIL.ImageFont.truetype(base_font_path, 24)
-    bg_path = LEADERBOARD_PATH / "quiz-leaderboard.png"
+def render_quiz_leaderboard(entries: list[tuple[str, int, bytes | None]]) -> bytes:
+    """Render a quiz leaderboard image. Blocking, run it in `render_executor`.
+
+    Parameters
+    ----------
+    entries : list[tuple[str, int, bytes | None]]
+        Name, score and encoded avatar (None if unavailable) of the top 3 users, best first.
+
+    Returns
+    -------
+    bytes
+        The PNG encoded image.
+
+    """
+    font, background = load_assets()
     title_text = "Quiz Leaderboard"
-    with PIL.Image.open(bg_path) as base_img:
-        draw = PIL.ImageDraw.Draw(base_img)
-        # Adjust font size and path
-        for rank, user_data in enumerate(leaderboard_data, start=1):
-            user, score = user_data
-            text = f"{rank}. {user}: {score}"
-            avatar_url = str(user.guild_avatar or user.display_avatar)
-            avatar = await load_image(avatar_url)
-            text_width = draw.textlength(text, font=font)
-            rank_1 = 1
-            rank_2 = 2
-            rank_3 = 3
-
-            if rank == rank_1:
-                score_x = base_img.width / 2
-                img_x = score_x - (avatar.width / 2)
-                text_x = score_x - (text_width / 2)
-                img_y = 150
-
-            elif rank == rank_2:
-                score_x = base_img.width / 4
-                img_x = score_x - (avatar.width / 2)
-                text_x = score_x - (text_width / 2)
-                img_y = 250
-            elif rank == rank_3:
-                score_x = (3 * base_img.width) / 4
-                img_x = score_x - (avatar.width / 2)
-                text_x = score_x - (text_width / 2)
-                img_y = 250
-            text_y = img_y + avatar.height + 10
+    base_img = background.copy()
+    draw = PIL.ImageDraw.Draw(base_img)
+    for rank, (name, score, avatar_data) in enumerate(entries, start=1):
+        text = f"{rank}. {name}: {score}"
+        if avatar_data:
+            with Image.open(io.BytesIO(avatar_data)) as avatar_file:
+                avatar = avatar_file.resize((AVATAR_SIZE, AVATAR_SIZE))
+        else:
+            avatar = None
+        text_width = draw.textlength(text, font=font)
+        rank_1 = 1
+        rank_2 = 2
+        rank_3 = 3
+
+        if rank == rank_1:
+            score_x = base_img.width / 2
+            img_y = 150
+        elif rank == rank_2:
+            score_x = base_img.width / 4
+            img_y = 250
+        elif rank == rank_3:
+            score_x = (3 * base_img.width) / 4
+            img_y = 250
+        img_x = score_x - (AVATAR_SIZE / 2)
+        text_x = score_x - (text_width / 2)
+        text_y = img_y + AVATAR_SIZE + 10
+        if avatar:
             base_img.paste(avatar, (int(img_x), img_y))
-            draw.text(
-                (int(text_x), int(text_y)),
-                text,
-                fill=(255, 255, 255),
-                font=font,
-            )
         draw.text(
-            (10, 80),
-            title_text,
+            (int(text_x), int(text_y)),
+            text,
             fill=(255, 255, 255),
             font=font,
         )
+    draw.text(
+        (10, 80),
+        title_text,
+        fill=(255, 255, 255),
+        font=font,
+    )
+
+    with io.BytesIO() as image_binary:
+        base_img.save(image_binary, "PNG")
+        return image_binary.getvalue()
+
+
+class AvatarCache:
+    """Two tier cache of avatar images, keyed by avatar hash and size.
+
+    Recently used avatars are kept in memory, least recently used first out,
+    and every downloaded avatar is also written to `directory` so that it
+    survives restarts. Once `directory` holds more than `max_files` avatars,
+    the least recently used ones are deleted. Misses are downloaded
+    concurrently over the shared `utils.http.http_client` session.
+
+    Parameters
+    ----------
+    directory : Path, optional
+        Directory of the on-disk tier (default is `CACHE_PATH` / "avatars").
+    size : int, optional
+        Size in pixels to request avatars at, a power of 2 (default is 64).
+    max_items : int, optional
+        Number of avatars kept in memory (default is 256).
+    max_files : int, optional
+        Number of avatars kept on disk (default is 2048).
 
-        return base_img
+    """
 
+    def __init__(
+        self,
+        directory: Path = CACHE_PATH / "avatars",
+        size: int = 64,
+        max_items: int = 256,
+        max_files: int = 2048,
+    ) -> None:
+        self.directory = directory
+        self.directory.mkdir(exist_ok=True)
+        self.size = size
+        self.max_items = max_items
+        self.max_files = max_files
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._pending: dict[str, asyncio.Task] = {}
 
-async def load_image(url: str, size: int = 50) -> Image.Image | None:
-    """Load an image from a URL and resize it."""
-    status_ok = 200
-    async with aiohttp.ClientSession().get(url) as resp:
-        if resp.status != status_ok:
+    async def get(self, asset: discord.Asset) -> bytes | None:
+        """Return the PNG encoded avatar, None if it could not be downloaded."""
+        key = f"{asset.key}_{self.size}"
+        if (data := self._memory.get(key)) is not None:
+            self._memory.move_to_end(key)
+            return data
+
+        # Concurrent lookups of the same avatar share one download
+        if key not in self._pending:
+            self._pending[key] = asyncio.create_task(self._load(key, asset))
+        try:
+            data = await asyncio.shield(self._pending[key])
+        finally:
+            self._pending.pop(key, None)
+
+        if data is not None:
+            self._memory[key] = data
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+        return data
+
+    async def get_many(self, assets: list[discord.Asset]) -> list[bytes | None]:
+        """Return several avatars, fetched concurrently."""
+        return await asyncio.gather(*(self.get(asset) for asset in assets))
+
+    async def _load(self, key: str, asset: discord.Asset) -> bytes | None:
+        """Read an avatar from disk, or download it and write it to disk."""
+        path = self.directory / f"{key}.png"
+        if (data := await asyncio.to_thread(self._read, path)) is not None:
+            return data
+
+        url = asset.with_format("png").with_size(self.size).url
+        status_ok = 200
+        try:
+            async with http_client.session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                if resp.status != status_ok:
+                    return None
+                data = await resp.read()
+        except (aiohttp.ClientError, TimeoutError):
             return None
-        data = io.BytesIO(await resp.read())
-        return Image.open(data).resize((size, size))
+
+        await asyncio.to_thread(self._write, path, data)
+        return data
+
+    @staticmethod
+    def _read(path: Path) -> bytes | None:
+        """Read an avatar from disk, marking it as recently used, None if it is not there."""
+        try:
+            os.utime(path)
+            return path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path: Path, data: bytes) -> None:
+        """Write an avatar to disk, deleting the least recently used ones if over `max_files`."""
+        path.write_bytes(data)
+        files = {}
+        for file in self.directory.glob("*.png"):
+            # Deleted by a concurrent write meanwhile
+            with contextlib.suppress(FileNotFoundError):
+                files[file] = file.stat().st_mtime
+        for file in sorted(files, key=files.get)[: max(0, len(files) - self.max_files)]:
+            file.unlink(missing_ok=True)
+
+
+avatar_cache = AvatarCache()
+
+
+async def generate_quiz_leaderboard_image(leaderboard_data: list[tuple[ResolvedMember, int]]) -> bytes:
+    """Generate a quiz leaderboard image.
+
+    Parameters
+    ----------
+    leaderboard_data : list[tuple[ResolvedMember, int]]
+        The top 3 users and their scores, best first.
+
+    Returns
+    -------
+    bytes
+        The PNG encoded image, ready to upload.
+
+    """
+    avatars = await avatar_cache.get_many([user.avatar for user, _ in leaderboard_data])
+    entries = [(user.name, score, avatar) for (user, score), avatar in zip(leaderboard_data, avatars, strict=True)]
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(render_executor, render_quiz_leaderboard, entries)
@@ -0,0 +1,128 @@
+from collections import Counter, OrderedDict
+from itertools import islice
+
+from utils.database import db
+
+
+class LeaderboardCache:
+    """Per-server cache of the highest scoring users, in front of `Database.get_leaderboard`.
+
+    Score updates go through `increment_scores`, which writes through to the
+    database and merges the new totals into the cached boards. Since scores
+    only ever grow, merging keeps every cached top `size` exact, so reads only
+    hit the database for servers that are not cached yet. A board read while
+    the server's scores were incremented may be stale and is not cached.
+
+    Parameters
+    ----------
+    size : int, optional
+        Number of users cached per server (default is 10).
+    max_servers : int, optional
+        Number of servers cached, least recently used first out (default is 1000).
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of reads served from and not served from the cache.
+
+    """
+
+    def __init__(self, size: int = 10, max_servers: int = 1000) -> None:
+        self.size = size
+        self.max_servers = max_servers
+        self.hits = 0
+        self.misses = 0
+        self._boards: OrderedDict[int, dict[int, int]] = OrderedDict()
+        # Reads in flight per server, and increments done meanwhile
+        self._reads: Counter[int] = Counter()
+        self._generations: Counter[int] = Counter()
+
+    async def get_leaderboard(self, server_id: int, limit: int = 5) -> dict:
+        """Return the highest scoring users in server.
+
+        Parameters
+        ----------
+        server_id : int
+            A Discord Server ID.
+        limit : int, optional
+            Number of users, at most `size` to be served from cache (default is 5).
+
+        Returns
+        -------
+        dict
+            Discord User IDs and their scores, highest first.
+
+        """
+        if limit > self.size:
+            self.misses += 1
+            return await db.get_leaderboard(server_id, limit)
+
+        if (board := self._boards.get(server_id)) is not None:
+            self.hits += 1
+            self._boards.move_to_end(server_id)
+        else:
+            self.misses += 1
+            board = await self._read(server_id)
+
+        return dict(islice(board.items(), limit))
+
+    async def increment_scores(self, server_id: int, deltas: dict[int, int]) -> dict[int, int]:
+        """Increment scores through `Database.increment_scores` and update the cached board.
+
+        Parameters
+        ----------
+        server_id : int
+            A Discord Server ID.
+        deltas : dict[int, int]
+            Discord User IDs and the points to add to their scores.
+
+        Returns
+        -------
+        dict[int, int]
+            Discord User IDs and their new scores.
+
+        """
+        totals = await db.increment_scores(server_id, deltas)
+        if self._reads[server_id]:
+            self._generations[server_id] += 1
+        if (board := self._boards.get(server_id)) is not None:
+            ranked = sorted({**board, **totals}.items(), key=lambda x: x[1], reverse=True)
+            self._boards[server_id] = dict(ranked[: self.size])
+        return totals
+
+    def invalidate(self, server_id: int) -> None:
+        """Drop a server's cached board, e.g. after its scores were set directly."""
+        self._boards.pop(server_id, None)
+        if self._reads[server_id]:
+            self._generations[server_id] += 1
+
+    def stats(self) -> dict[str, int]:
+        """Return the cache's hit and miss counters and the number of cached servers."""
+        return {"hits": self.hits, "misses": self.misses, "servers": len(self._boards)}
+
+    async def _read(self, server_id: int) -> dict[int, int]:
+        """Read a board from the database, caching it unless scores were incremented during the read."""
+        generation = self._generations[server_id]
+        self._reads[server_id] += 1
+        try:
+            board = await db.get_leaderboard(server_id, self.size)
+            fresh = self._generations[server_id] == generation
+        finally:
+            self._reads[server_id] -= 1
+            if not self._reads[server_id]:
+                del self._reads[server_id]
+                self._generations.pop(server_id, None)
+
+        if fresh:
+            self._store(server_id, board)
+        return board
+
+    def _store(self, server_id: int, board: dict[int, int]) -> None:
+        """Cache a board, evicting the least recently used one if full."""
+        self._boards[server_id] = board
+        self._boards.move_to_end(server_id)
+        while len(self._boards) > self.max_servers:
+            self._boards.popitem(last=False)
+
+
+leaderboard_cache = LeaderboardCache()
@@ -0,0 +1,168 @@
+import asyncio
+import random
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass
+
+import discord
+
+
+@dataclass(frozen=True)
+class ResolvedMember:
+    """Snapshot of the member details the bot displays.
+
+    Attributes
+    ----------
+    id : int
+        A Discord User ID.
+    name : str
+        The member's username.
+    display_name : str
+        The member's server nickname, or global name, or username.
+    avatar
+        The member's server avatar, or avatar, or default avatar, as a `discord.Asset`.
+
+    """
+
+    id: int
+    name: str
+    display_name: str
+    avatar: discord.Asset
+
+    @classmethod
+    def from_member(cls, member: discord.Member) -> "ResolvedMember":
+        """Snapshot a member."""
+        return cls(member.id, str(member), member.display_name, member.display_avatar)
+
+
+class MemberResolver:
+    """Resolve user IDs to guild members with as few requests as possible.
+
+    The gateway's member cache is checked first, then a short lived cache of
+    members resolved earlier. The remaining misses are resolved through a
+    single chunked gateway member query per 100 users.
+
+    Parameters
+    ----------
+    ttl : float, optional
+        Seconds a resolved member is cached for (default is 5 minutes).
+    max_items : int, optional
+        Number of cached members above which expired ones are pruned (default is 10000).
+
+    """
+
+    chunk_size = 100
+
+    def __init__(self, ttl: float = 5 * 60, max_items: int = 10_000) -> None:
+        self.ttl = ttl
+        self.max_items = max_items
+        self._cache: dict[tuple[int, int], tuple[float, ResolvedMember]] = {}
+
+    async def resolve(self, guild: discord.Guild, user_ids: Iterable[int]) -> dict[int, ResolvedMember]:
+        """Resolve the members of a guild.
+
+        Parameters
+        ----------
+        guild
+            The `discord.Guild` the users are members of.
+        user_ids : Iterable[int]
+            Discord User IDs.
+
+        Returns
+        -------
+        dict[int, ResolvedMember]
+            Discord User IDs and their members. Users who are not
+            members of the guild are left out.
+
+        """
+        now = time.monotonic()
+        resolved = {}
+        misses = []
+        for user_id in dict.fromkeys(user_ids):
+            if member := guild.get_member(user_id):
+                resolved[user_id] = ResolvedMember.from_member(member)
+            elif (cached := self._cache.get((guild.id, user_id))) and cached[0] > now:
+                resolved[user_id] = cached[1]
+            else:
+                misses.append(user_id)
+
+        for start in range(0, len(misses), self.chunk_size):
+            for member in await self._query(guild, misses[start : start + self.chunk_size]):
+                resolved[member.id] = ResolvedMember.from_member(member)
+                self._cache[guild.id, member.id] = (now + self.ttl, resolved[member.id])
+
+        if len(self._cache) > self.max_items:
+            self._cache = {key: value for key, value in self._cache.items() if value[0] > now}
+        return resolved
+
+    async def _query(self, guild: discord.Guild, user_ids: list[int]) -> list[discord.Member]:
+        """Query members over the gateway, falling back to REST if that is unavailable."""
+        try:
+            return await guild.query_members(user_ids=user_ids, limit=len(user_ids))
+        except (discord.ClientException, TimeoutError):
+            members = await asyncio.gather(
+                *(guild.fetch_member(user_id) for user_id in user_ids),
+                return_exceptions=True,
+            )
+            return [member for member in members if isinstance(member, discord.Member)]
+
+
+member_resolver = MemberResolver()
+
+
+class MemberSampler:
+    """Pick random human members of a guild without walking its member list every time.
+
+    The IDs of a guild's human members are snapshotted at most once per
+    `ttl`, samples are drawn from the snapshot and checked against the
+    gateway's member cache, so members who left are skipped.
+
+    Parameters
+    ----------
+    ttl : float, optional
+        Seconds a guild's snapshot is used for (default is 10 minutes).
+
+    """
+
+    def __init__(self, ttl: float = 10 * 60) -> None:
+        self.ttl = ttl
+        self._pools: dict[int, tuple[float, list[int]]] = {}
+
+    def sample(self, guild: discord.Guild, k: int, exclude: Iterable[int] = ()) -> list[discord.Member]:
+        """Pick up to `k` distinct random human members.
+
+        Parameters
+        ----------
+        guild
+            The `discord.Guild` to pick members of.
+        k : int
+            Number of members.
+        exclude : Iterable[int], optional
+            Discord User IDs not to pick (default is none).
+
+        Returns
+        -------
+        list[discord.Member]
+            The members, fewer than `k` if the guild does not have enough.
+
+        """
+        now = time.monotonic()
+        if (pool := self._pools.get(guild.id)) is None or pool[0] <= now:
+            pool = self._pools[guild.id] = (now + self.ttl, [member.id for member in guild.members if not member.bot])
+
+        # Draw random indices rather than shuffling, a sample only touches about k entries
+        user_ids = pool[1]
+        excluded = set(exclude)
+        tried = set()
+        members = []
+        while len(members) < k and len(tried) < len(user_ids):
+            index = random.randrange(len(user_ids))  # noqa: S311
+            if index in tried:
+                continue
+            tried.add(index)
+            if user_ids[index] not in excluded and (member := guild.get_member(user_ids[index])):
+                members.append(member)
+        return members
+
+
+member_sampler = MemberSampler()
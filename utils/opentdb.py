@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, TypedDict
+
+import aiohttp
+
+from utils.http import http_client
+
+logger = logging.getLogger("opentdb")
+
+BASE_URL = "https://opentdb.com"
+
+
+class ResponseCode(IntEnum):
+    """Response codes returned by the Open Trivia Database API."""
+
+    SUCCESS = 0
+    NO_RESULTS = 1
+    INVALID_PARAMETER = 2
+    TOKEN_NOT_FOUND = 3
+    TOKEN_EMPTY = 4
+    RATE_LIMIT = 5
+
+
+class OpenTDBError(Exception):
+    """Raised when Open Trivia Database could not serve a request."""
+
+
+class Category(TypedDict):
+    """A trivia category as listed by `api_category.php`."""
+
+    id: int
+    name: str
+
+
+class Question(TypedDict):
+    """A trivia question as returned by `api.php`."""
+
+    type: str
+    difficulty: str
+    category: str
+    question: str
+    correct_answer: str
+    incorrect_answers: list[str]
+
+
+@dataclass(frozen=True)
+class QuestionsResult:
+    """Outcome of a questions request.
+
+    Attributes
+    ----------
+    response_code : ResponseCode
+        The response code reported by the API.
+    results : list[Question]
+        The questions, empty unless the request succeeded.
+
+    """
+
+    response_code: ResponseCode
+    results: list[Question] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        """Whether the request succeeded."""
+        return self.response_code == ResponseCode.SUCCESS
+
+
+class OpenTDB:
+    """Asynchronous Open Trivia Database client.
+
+    All requests go through the shared `utils.http.http_client` session and
+    are bounded by a deadline, so an unresponsive API can never stall the
+    event loop. Requests to the questions endpoint are spaced out to respect
+    the API's per-IP rate limit.
+
+    Parameters
+    ----------
+    timeout : float
+        Deadline in seconds for a single request, connection included.
+    rate_limit : float
+        Minimum number of seconds between two questions requests.
+
+    """
+
+    def __init__(self, timeout: float = 8, rate_limit: float = 5) -> None:
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=3)
+        self.rate_limit = rate_limit
+        self._rate_lock = asyncio.Lock()
+        self._last_request = 0.0
+
+    async def _get_json(self, path: str, params: dict[str, Any] | None = None) -> dict:
+        """Fetch an endpoint and decode its JSON body.
+
+        Raises
+        ------
+        OpenTDBError
+            If the request failed or did not finish before the deadline.
+
+        """
+        try:
+            async with http_client.session.get(f"{BASE_URL}/{path}", params=params, timeout=self.timeout) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+        except (aiohttp.ClientError, TimeoutError) as e:
+            logger.warning("Request to %s failed: %r", path, e)
+            msg = f"Request to {path} failed."
+            raise OpenTDBError(msg) from e
+
+    async def _throttle(self) -> None:
+        """Wait until another questions request is allowed."""
+        delay = self._last_request + self.rate_limit - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._last_request = time.monotonic()
+
+    async def categories(self) -> list[Category]:
+        """Return all trivia categories."""
+        data = await self._get_json("api_category.php")
+        return data["trivia_categories"]
+
+    async def questions(
+        self,
+        amount: int,
+        category: int | None = None,
+        difficulty: str | None = None,
+        type: str | None = None,
+        token: str | None = None,
+    ) -> QuestionsResult:
+        """Fetch trivia questions.
+
+        Parameters
+        ----------
+        amount : int
+            Number of questions, at most 50.
+        category : int | None, optional
+            Optionally specified category ID. Defaults to None.
+        difficulty : str | None, optional
+            Optionally specified difficulty. Defaults to None.
+        type : str | None, optional
+            Optionally specified question type. Defaults to None.
+        token : str | None, optional
+            Session token preventing repeated questions. Defaults to None.
+
+        Returns
+        -------
+        QuestionsResult
+            The response code and the raw (HTML escaped) questions.
+
+        """
+        params = {"amount": amount, "category": category, "difficulty": difficulty, "type": type, "token": token}
+        params = {key: value for key, value in params.items() if value}
+
+        async with self._rate_lock:
+            await self._throttle()
+            data = await self._get_json("api.php", params)
+
+            # Another client on this IP beat us to it, wait out the window once
+            if data["response_code"] == ResponseCode.RATE_LIMIT:
+                await self._throttle()
+                data = await self._get_json("api.php", params)
+
+        return QuestionsResult(ResponseCode(data["response_code"]), data.get("results", []))
+
+    async def request_token(self) -> str:
+        """Request a new session token."""
+        data = await self._get_json("api_token.php", {"command": "request"})
+        return data["token"]
+
+
+opentdb = OpenTDB()
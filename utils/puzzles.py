@@ -0,0 +1,264 @@
+import asyncio
+import contextlib
+import logging
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+import wikipedia
+
+from utils.scheduler import Priority
+from utils.wiki import TooFewSentencesError, get_wiki_image, get_wiki_statements, normalize_title
+
+logger = logging.getLogger("puzzles")
+
+# Errors building a puzzle which retrying would run into again
+PERMANENT_ERRORS = (wikipedia.DisambiguationError, wikipedia.PageError, TooFewSentencesError)
+
+
+@dataclass(frozen=True)
+class Puzzle:
+    """A complete factpedia puzzle.
+
+    Attributes
+    ----------
+    facts : list[str]
+        The statements, one of which is false.
+    false_index : int
+        Index of the false statement.
+    correction : str
+        The fact the false statement was made from.
+    image : str | None
+        URL of the article's image, if it has one.
+    built_at : float
+        Monotonic time the puzzle was built at.
+
+    """
+
+    facts: list[str]
+    false_index: int
+    correction: str
+    image: str | None
+    built_at: float
+
+
+async def build_puzzle(entry: str, number: int, priority: Priority = Priority.INTERACTIVE) -> Puzzle:
+    """Build a puzzle out of a Wikipedia article.
+
+    Parameters
+    ----------
+    entry : str
+        Title of the article.
+    number : int
+        Number of statements.
+    priority : Priority, optional
+        Scheduling priority of the Gemini request, if one is needed (default is `Priority.INTERACTIVE`).
+
+    Returns
+    -------
+    Puzzle
+        The puzzle.
+
+    Raises
+    ------
+    DisambiguationError, PageError, TooFewSentencesError, GeminiError
+        As raised by `utils.wiki.get_wiki_statements`.
+
+    """
+    facts, false_index, correction = await get_wiki_statements(entry, number, priority)
+    image = await get_wiki_image(entry) or None
+    return Puzzle(facts, false_index, correction, image, time.monotonic())
+
+
+class PuzzlePool:
+    """Warm pool of complete factpedia puzzles for recently requested entries.
+
+    Every request is remembered as wanted by its server. While idle, a
+    background job builds puzzles for the wanted entries at background
+    priority, taking turns between servers so that a busy one cannot keep the
+    others' entries cold. Puzzles are shared between servers and used once.
+    An entry whose build fails for good is no longer kept warm, one which
+    fails otherwise, e.g. while Gemini is busy, is retried after a back-off.
+
+    Parameters
+    ----------
+    per_entry : int, optional
+        Number of puzzles kept per entry (default is 2).
+    max_entries : int, optional
+        Number of entries kept, least recently used first out (default is 200).
+    per_guild : int, optional
+        Number of recently requested entries kept warm per server (default is 5).
+    max_age : float, optional
+        Seconds a puzzle is served for (default is 30 minutes).
+    interest : float, optional
+        Seconds an entry is kept warm after it was last requested (default is 1 hour).
+    interval : float, optional
+        Seconds between two background builds (default is 5).
+    backoff : float, optional
+        Seconds before an entry is built again after a failure, doubled
+        after every failure in a row (default is 1 minute).
+
+    Attributes
+    ----------
+    hits, misses : int
+        Number of requests served from and not served from the pool.
+
+    """
+
+    def __init__(
+        self,
+        per_entry: int = 2,
+        max_entries: int = 200,
+        per_guild: int = 5,
+        max_age: float = 30 * 60,
+        interest: float = 60 * 60,
+        interval: float = 5,
+        backoff: float = 60,
+    ) -> None:
+        self.per_entry = per_entry
+        self.max_entries = max_entries
+        self.per_guild = per_guild
+        self.max_age = max_age
+        self.interest = interest
+        self.interval = interval
+        self.backoff = backoff
+        self.hits = 0
+        self.misses = 0
+        self._puzzles: OrderedDict[tuple[str, int], deque[Puzzle]] = OrderedDict()
+        # Servers, in turn order, and the entries they requested, most recent last
+        self._wanted: OrderedDict[int, OrderedDict[tuple[str, int], tuple[str, float]]] = OrderedDict()
+        # Entries whose last builds failed, with the number of failures in a row and when to build them again
+        self._failures: dict[tuple[str, int], tuple[int, float]] = {}
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start the background job, unless it is already running."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refill_loop())
+
+    async def get(self, guild_id: int | None, entry: str, number: int) -> Puzzle:
+        """Return a puzzle, from the pool if one is ready, otherwise built right away.
+
+        Parameters
+        ----------
+        guild_id : int | None
+            The Discord Server ID the puzzle is requested in.
+        entry : str
+            Title of the article.
+        number : int
+            Number of statements.
+
+        Returns
+        -------
+        Puzzle
+            The puzzle.
+
+        Raises
+        ------
+        DisambiguationError, PageError, GeminiError
+            As raised by `utils.wiki.get_wiki_statements`.
+
+        """
+        key = (normalize_title(entry), number)
+        if puzzles := self._fresh(key):
+            self.hits += 1
+            puzzle = puzzles.popleft()
+        else:
+            self.misses += 1
+            puzzle = await build_puzzle(entry, number)
+
+        self._want(guild_id, key, entry)
+        self._wake.set()
+        return puzzle
+
+    def stats(self) -> dict[str, int]:
+        """Return the pool's hit and miss counters, and the number of pooled puzzles and wanted entries."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "puzzles": sum(len(puzzles) for puzzles in self._puzzles.values()),
+            "wanted": sum(len(wanted) for wanted in self._wanted.values()),
+        }
+
+    def _fresh(self, key: tuple[str, int]) -> deque[Puzzle]:
+        """Return the puzzles of an entry, dropping the stale ones."""
+        puzzles = self._puzzles.get(key, deque())
+        while puzzles and puzzles[0].built_at + self.max_age <= time.monotonic():
+            puzzles.popleft()
+        return puzzles
+
+    def _want(self, guild_id: int | None, key: tuple[str, int], entry: str) -> None:
+        """Remember an entry as requested by a server, forgetting its oldest request if over `per_guild`."""
+        wanted = self._wanted.setdefault(guild_id, OrderedDict())
+        wanted[key] = (entry, time.monotonic() + self.interest)
+        wanted.move_to_end(key)
+        while len(wanted) > self.per_guild:
+            wanted.popitem(last=False)
+
+    def _next(self) -> tuple[tuple[str, int], str] | None:
+        """Pick the next entry to build a puzzle for, taking turns between servers."""
+        now = time.monotonic()
+        for guild_id in list(self._wanted):
+            wanted = self._wanted[guild_id]
+            for key, (_, until) in list(wanted.items()):
+                if until <= now:
+                    del wanted[key]
+            if not wanted:
+                del self._wanted[guild_id]
+                continue
+
+            # Most recently requested first
+            for key, (entry, _) in reversed(wanted.items()):
+                if len(self._fresh(key)) < self.per_entry and self._failures.get(key, (0, 0))[1] <= now:
+                    self._wanted.move_to_end(guild_id)
+                    return key, entry
+
+        # Failures of entries no longer wanted
+        wanted_keys = {key for wanted in self._wanted.values() for key in wanted}
+        for key in self._failures.keys() - wanted_keys:
+            del self._failures[key]
+        return None
+
+    def _store(self, key: tuple[str, int], puzzle: Puzzle) -> None:
+        """Pool a puzzle, evicting the least recently used entry if full."""
+        self._puzzles.setdefault(key, deque()).append(puzzle)
+        self._puzzles.move_to_end(key)
+        while len(self._puzzles) > self.max_entries:
+            self._puzzles.popitem(last=False)
+
+    def _forget(self, key: tuple[str, int]) -> None:
+        """Stop keeping an entry warm."""
+        self._failures.pop(key, None)
+        for wanted in self._wanted.values():
+            wanted.pop(key, None)
+
+    def _back_off(self, key: tuple[str, int]) -> None:
+        """Hold off building an entry again, twice as long as after its previous failure."""
+        failures = self._failures.get(key, (0, 0))[0] + 1
+        delay = min(self.backoff * 2 ** (failures - 1), self.max_age / 2)
+        self._failures[key] = (failures, time.monotonic() + delay)
+
+    async def _refill_loop(self) -> None:
+        """Build puzzles for the wanted entries whenever some are missing, or went stale meanwhile."""
+        while True:
+            with contextlib.suppress(TimeoutError):
+                async with asyncio.timeout(self.max_age / 2):
+                    await self._wake.wait()
+            self._wake.clear()
+            while (job := self._next()) is not None:
+                key, entry = job
+                try:
+                    self._store(key, await build_puzzle(entry, key[1], Priority.BACKGROUND))
+                except PERMANENT_ERRORS:
+                    logger.info("No puzzle can be built about %s, no longer keeping it warm.", entry)
+                    self._forget(key)
+                except Exception:
+                    logger.warning("Could not build a puzzle about %s, retrying later.", entry, exc_info=True)
+                    self._back_off(key)
+                else:
+                    self._failures.pop(key, None)
+                await asyncio.sleep(self.interval)
+
+
+puzzle_pool = PuzzlePool()
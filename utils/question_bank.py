@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+import logging
+
+from pymongo.errors import PyMongoError
+
+from utils.catalogue import catalogue
+from utils.database import db
+from utils.opentdb import OpenTDBError, ResponseCode, opentdb
+
+logger = logging.getLogger("question_bank")
+
+
+def content_hash(quiz: dict) -> str:
+    """Return a hash identifying a question by its content.
+
+    Parameters
+    ----------
+    quiz : dict
+        A quiz as returned by `utils.quiz.fetch_quizzes`.
+
+    Returns
+    -------
+    str
+        Hex digest of the question and its answers.
+
+    """
+    content = [
+        quiz["question"].strip().casefold(),
+        quiz["correct_answer"].strip().casefold(),
+        sorted(answer.strip().casefold() for answer in quiz["incorrect_answers"]),
+    ]
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+
+def bank_document(quiz: dict, category_id: int | None) -> dict:
+    """Tag a quiz with its content hash and category ID, as stored in the question bank.
+
+    Parameters
+    ----------
+    quiz : dict
+        A quiz as returned by `utils.quiz.fetch_quizzes`.
+    category_id : int | None
+        ID of the opentdb category the quiz was fetched from.
+
+    Returns
+    -------
+    dict
+        The same quiz, with keys hash and category_id added.
+
+    """
+    quiz["hash"] = content_hash(quiz)
+    quiz["category_id"] = category_id
+    return quiz
+
+
+class QuestionBank:
+    """Bulk ingestion job filling the question bank from opentdb.
+
+    Runs in the background and tops every category up to `target`
+    questions, so that quizzes can be served without opentdb.
+
+    Parameters
+    ----------
+    target : int, optional
+        Number of questions to keep banked per category (default is 200).
+    batch_size : int, optional
+        Number of questions per opentdb request, at most 50 (default is 50).
+    interval : float, optional
+        Seconds between two ingestion runs (default is 6 hours).
+
+    """
+
+    def __init__(self, target: int = 200, batch_size: int = 50, interval: float = 6 * 60 * 60) -> None:
+        self.target = target
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start the ingestion job, unless it is already running."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._ingest_loop())
+
+    async def ingest(self, category_id: int, token: str) -> int:
+        """Top a category up to the target size.
+
+        Parameters
+        ----------
+        category_id : int
+            ID of the opentdb category.
+        token : str
+            An opentdb session token, so that no question is fetched twice.
+
+        Returns
+        -------
+        int
+            Number of questions added to the bank.
+
+        """
+        from utils.quiz import fetch_quizzes
+
+        added = 0
+        amount = self.batch_size
+        while await db.count_questions(category_id) < self.target:
+            result = await opentdb.questions(amount, category_id, token=token)
+
+            # Fewer questions left than requested, ask for less
+            if result.response_code == ResponseCode.NO_RESULTS and amount > 1:
+                amount //= 2
+                continue
+            if not result.ok:
+                break
+
+            # Nothing new means the token keeps serving known questions
+            quizzes = [bank_document(quiz, category_id) for quiz in fetch_quizzes(result.results)]
+            if not (new := await db.add_questions(quizzes)):
+                break
+            added += new
+
+        return added
+
+    async def _ingest_loop(self) -> None:
+        """Periodically top every category up."""
+        while True:
+            try:
+                token = await opentdb.request_token()
+                for category_id in catalogue.topic_ids():
+                    if added := await self.ingest(category_id, token):
+                        logger.info("Banked %d questions of category %d.", added, category_id)
+            except (OpenTDBError, PyMongoError):
+                logger.exception("Question bank ingestion failed, retrying later.")
+
+            await asyncio.sleep(self.interval)
+
+
+question_bank = QuestionBank()
@@ -1,47 +1,19 @@
 import asyncio
+import contextlib
 import html
 import random
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
 
 import aiohttp
 import discord
-import requests
 from bs4 import BeautifulSoup
 
+from utils.catalogue import catalogue
 from utils.database import db
-
-
-def fetch_categories() -> dict:
-    """Create structured categories.
-
-    Note that the returned instance is a defaultdict.
-
-    Returns
-    -------
-    A dictionary structuring all categories.
-
-    """
-    response = requests.get("https://opentdb.com/api_category.php", timeout=(3, 5))
-    raw_categories = response.json()["trivia_categories"]
-
-    structured_categories = defaultdict(dict)
-
-    for category in raw_categories:
-        topic: str = category["name"]
-        id = category["id"]
-
-        if ":" in topic:
-            topic, subtopic = topic.split(": ")
-            structured_categories[topic][subtopic] = id
-        else:
-            structured_categories[topic] = id
-
-    return structured_categories
-
-
-# defaultdict(<class 'dict'>, {'General Knowledge': 9, 'Entertainment': {'Books': 10, 'Film': 11, 'Music': 12, 'Musicals & Theatres': 13, 'Television': 14, 'Video Games': 15, 'Board Games': 16, 'Comics': 29, 'Japanese Anime & Manga': 31, 'Cartoon & Animations': 32}, 'Science & Nature': 17, 'Science': {'Computers': 18, 'Mathematics': 19, 'Gadgets': 30}, 'Mythology': 20, 'Sports': 21, 'Geography': 22, 'History': 23, 'Politics': 24, 'Art': 25, 'Celebrities': 26, 'Animals': 27, 'Vehicles': 28})  # noqa: E501
-
-TOPICS_POOL = fetch_categories()
+from utils.http import http_client
+from utils.members import ResolvedMember, member_resolver
+from utils.opentdb import OpenTDBError, opentdb
+from utils.question_bank import bank_document
 
 
 def has_sub_topic(topic: str) -> bool:
@@ -58,7 +30,7 @@ def has_sub_topic(topic: str) -> bool:
         Whether or not the topic has a subtopic.
 
     """
-    return not isinstance(TOPICS_POOL[topic], int)
+    return not isinstance(catalogue.topics[topic], int)
 
 
 def get_topic_id(topic: str) -> int:
@@ -75,7 +47,7 @@ def get_topic_id(topic: str) -> int:
         The corresponding topic ID.
 
     """
-    return TOPICS_POOL[topic]
+    return catalogue.topics[topic]
 
 
 def get_sub_topic_id(topic: str, topic_id_correct_count: dict) -> int:
@@ -97,7 +69,7 @@ def get_sub_topic_id(topic: str, topic_id_correct_count: dict) -> int:
         ID of the cherry picked subtopic.
 
     """
-    all_topic_ids = list(TOPICS_POOL[topic].values())
+    all_topic_ids = list(catalogue.topics[topic].values())
     if not topic_id_correct_count:
         return random.choice(all_topic_ids)  # noqa: S311
 
@@ -138,17 +110,49 @@ def weighted_selection(all_ids: list, ordered_correct_count: list) -> int:
     return random.choices(all_ids, weights=weights)[0]  # noqa: S311
 
 
-def create_api_call(
-    number_of_q: int,
+def fetch_quizzes(json: list) -> list:
+    """Return list of quizzes based on json.
+
+    Parameters
+    ----------
+    json : list
+        A collection of raw questions as returned by `OpenTDB.questions`.
+
+    Returns
+    -------
+    list
+        A collection of quiz dictionaries having keys
+        question, correct_answer, incorrect_answers.
+
+    """
+    quizzes = []
+    for quiz in json:
+        quiz["question"] = html.unescape(quiz["question"])
+        quiz["correct_answer"] = html.unescape(quiz["correct_answer"])
+        quiz["incorrect_answers"] = [html.unescape(answer) for answer in quiz["incorrect_answers"]]
+
+        quizzes.append(quiz)
+
+    return quizzes
+
+
+async def fetch_quizzes_with_token(
+    server_id: int,
+    amount: int,
     category: int | None = None,
     difficulty: str | None = None,
     type: str | None = None,
-) -> str:
-    """Create an URL that calls Open Trivia Database API.
+) -> list:
+    """Return list of quizzes fetched from opentdb with token check.
+
+    The server's quiz token is sent along with this request. It ensures that
+    old questions are not fetched again.
 
     Parameters
     ----------
-    number_of_q : int
+    server_id : int
+        A Discord Server ID.
+    amount : int
         Number of questions.
     category : int | None, optional
         Optionally specified integer that corresponds to a category.
@@ -156,126 +160,221 @@ def create_api_call(
     difficulty : str | None, optional
         Optionally specified difficulty. Defaults to None.
     type : str | None, optional
-        Optionally specified type (topic). Defaults to None.
+        Optionally specified type (multiple or boolean). Defaults to None.
 
     Returns
     -------
-    str
-        The query string.
-
-    """
-    # Could've used params but it'll interfere with token.
-    url = f"https://opentdb.com/api.php?amount={number_of_q}"
-    if category:
-        url += f"&category={category}"
-    if difficulty:
-        url += f"&difficulty={difficulty}"
-    if type:
-        url += f"&type={type}"
-    return url
-
+    list
+        A collection of quizzes as returned by `fetch_quizzes`.
 
-def fetch_json(url: str) -> list:
-    """Fetch API from opentdb. Return False if bad response code.
+    Raises
+    ------
+    OpenTDBError
+        If opentdb could not serve the questions, even with a fresh token.
 
-    Parameters
-    ----------
-    url : str
-        An url as returned by a call to `create_api_call`.
+    """
+    # No token yet
+    if not (current_token := await db.get_token(server_id)):
+        current_token = await opentdb.request_token()
+        await db.change_token(server_id, current_token)
 
-    Returns
-    -------
-    list
-        A collection of trivia questions and answers.
-    bool
-        Returns False if response code is nonzero (indicating failure).
+    # Current token works
+    result = await opentdb.questions(amount, category, difficulty, type, token=current_token)
+    if result.ok:
+        return fetch_quizzes(result.results)
 
-    """
-    try:
-        response = requests.get(url, timeout=(3, 5))
-    except requests.exceptions.Timeout:
-        print("Timed out")
+    # Current token no longer works
+    new_token = await opentdb.request_token()
+    await db.change_token(server_id, new_token)
 
-    if response.json()["response_code"] != 0:
-        return False
+    result = await opentdb.questions(amount, category, difficulty, type, token=new_token)
+    if not result.ok:
+        msg = f"Could not fetch questions (response code {result.response_code.name})."
+        raise OpenTDBError(msg)
+    return fetch_quizzes(result.results)
 
-    return response.json()["results"]
 
+async def get_quizzes_with_token(
+    server_id: int,
+    amount: int,
+    category: int | None = None,
+    difficulty: str | None = None,
+    type: str | None = None,
+) -> list:
+    """Return list of quizzes, served from the question bank first.
 
-def fetch_quizzes(json: list) -> list:
-    """Return list of quizzes based on json.
+    Questions recently asked in the server are left out. Whatever the bank
+    cannot serve is fetched with `fetch_quizzes_with_token` and banked.
+    The questions are not registered as asked, see `QuestionPrefetcher.get`.
 
     Parameters
     ----------
-    json : list
-        A collection as returned by `fetch_json`.
+    server_id : int
+        A Discord Server ID.
+    amount : int
+        Number of questions.
+    category : int | None, optional
+        Optionally specified integer that corresponds to a category.
+        Defaults to None.
+    difficulty : str | None, optional
+        Optionally specified difficulty. Defaults to None.
+    type : str | None, optional
+        Optionally specified type (multiple or boolean). Defaults to None.
 
     Returns
     -------
     list
-        A collection of quiz dictionaries having keys
-        question, correct_answer, incorrect_answers.
+        A collection of quizzes as returned by `fetch_quizzes`,
+        tagged as by `utils.question_bank.bank_document`.
+
+    Raises
+    ------
+    OpenTDBError
+        If neither the bank nor opentdb could serve any question.
 
     """
-    quizzes = []
-    for quiz in json:
-        quiz["question"] = html.unescape(quiz["question"])
-        quiz["correct_answer"] = html.unescape(quiz["correct_answer"])
-        quiz["incorrect_answers"] = [html.unescape(answer) for answer in quiz["incorrect_answers"]]
+    seen = await db.get_seen_questions(server_id)
+    quizzes = await db.sample_questions(amount, category, difficulty, type, exclude=seen)
 
-        quizzes.append(quiz)
+    # Top the bank up with what it could not serve
+    if len(quizzes) < amount:
+        try:
+            fetched = await fetch_quizzes_with_token(server_id, amount - len(quizzes), category, difficulty, type)
+        except OpenTDBError:
+            if not quizzes:
+                raise
+            fetched = []
 
-    return quizzes
+        fetched = [bank_document(quiz, category) for quiz in fetched]
+        await db.add_questions(fetched)
 
+        hashes = {quiz["hash"] for quiz in quizzes}
+        quizzes += [quiz for quiz in fetched if quiz["hash"] not in hashes]
 
-async def fetch_token() -> str:
-    """Fetch a token from the API."""
-    url = "https://opentdb.com/api_token.php?command=request"
-    async with aiohttp.ClientSession().get(url, timeout=3) as response:
-        return (await response.json())["token"]
+    return quizzes
 
 
-async def get_quizzes_with_token(server_id: int, api_url: str) -> list:
-    """Return list of quizzes with token check.
+class QuestionPrefetcher:
+    """In-memory question queue for a single quiz.
 
-    If there is an active quiz in a channel, send that quiz token
-    along with this request. It ensures that old questions are not fetched again.
+    Questions are fetched ahead of time in batches, so that the time between
+    two questions does not depend on opentdb's latency. A fixed topic should
+    be prefetched as a whole right after voting ends, whereas only the
+    subtopic picked for the first question should get a small buffer then,
+    the others being fetched on demand once picked. Questions are registered
+    as asked in the server when they are handed out, so that the buffered
+    ones which are never asked can still be served by the bank later.
 
     Parameters
     ----------
-    channel_id : int
-        A Discord Channel ID.
     server_id : int
         A Discord Server ID.
-    api_url : str
-        An API call URL to opentdb.
+    number : int
+        Number of questions in the quiz.
+    buffer_size : int, optional
+        Number of questions fetched at once for a subtopic (default is 3).
 
-    Returns
-    -------
-    list
-        A collection of quizzes as returned by `fetch_quizzes`.
+    Attributes
+    ----------
+    remaining : int
+        Number of questions the quiz still needs.
 
     """
-    # If token exists
-    if current_token := await db.get_token(server_id):
-        # Current token works
-        if json := fetch_json(api_url + f"&token={current_token}"):
-            return fetch_quizzes(json)
 
-        # Current token no longer works
-        await asyncio.sleep(5)
-        new_token = await fetch_token()
-        await db.change_token(server_id, new_token)
-
-        return fetch_quizzes(fetch_json(api_url + f"&token={new_token}"))
+    def __init__(self, server_id: int, number: int, buffer_size: int = 3) -> None:
+        self.server_id = server_id
+        self.remaining = number
+        self.buffer_size = buffer_size
+        self._buffers: dict[int, deque] = defaultdict(deque)
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def prefetch(self, topic_id: int, amount: int) -> None:
+        """Start fetching questions of a topic in the background.
+
+        Nothing happens if a fetch for that topic is already in flight.
+
+        Parameters
+        ----------
+        topic_id : int
+            ID of the topic to fetch questions from.
+        amount : int
+            Number of questions to fetch.
+
+        """
+        task = self._tasks.get(topic_id)
+        if task and not task.done():
+            return
+        self._tasks[topic_id] = asyncio.create_task(self._fetch(topic_id, amount))
+
+    async def _fetch(self, topic_id: int, amount: int) -> None:
+        """Fetch questions of a topic into its buffer."""
+        quizzes = await get_quizzes_with_token(self.server_id, amount, topic_id)
+        self._buffers[topic_id].extend(quizzes)
+
+    async def get(self, topic_id: int) -> dict:
+        """Return the next question of a topic.
+
+        Waits for an in-flight fetch of the topic, or starts a buffer sized
+        fetch if the topic's buffer is empty. The question is registered as
+        asked in the server.
+
+        Parameters
+        ----------
+        topic_id : int
+            ID of the topic.
+
+        Returns
+        -------
+        dict
+            A quiz as returned by `fetch_quizzes`.
+
+        Raises
+        ------
+        OpenTDBError
+            If opentdb could not serve the question.
+        PyMongoError
+            If the question could not be registered as asked.
+
+        """
+        buffer = self._buffers[topic_id]
+        if not buffer:
+            self.prefetch(topic_id, max(1, min(self.buffer_size, self.remaining)))
+            with contextlib.suppress(OpenTDBError):
+                await self._tasks[topic_id]
+
+        # A batch fails if the topic runs out of questions, fall back to a single one
+        if not buffer:
+            self.prefetch(topic_id, 1)
+            await self._tasks[topic_id]
+
+        self.remaining -= 1
+        quiz = buffer.popleft()
+        await db.add_seen_questions(self.server_id, [quiz["hash"]])
+        return quiz
+
+    def close(self) -> None:
+        """Cancel any fetch still in flight, and retrieve the errors of those which failed."""
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+
+def first_wikipedia_link(content: str) -> str | None:
+    """Return the first Wikipedia article link of an HTML page, None if there is none."""
+    soup = BeautifulSoup(content, "html.parser")
+    search_results = soup.find_all("a")
 
-    # No token yet
-    new_token = await fetch_token()
-    await db.change_token(server_id, new_token)
-    return fetch_quizzes(fetch_json(api_url + f"&token={new_token}"))
+    # Find the first Wikipedia link
+    for link in search_results:
+        href: str = link.get("href")
+        if href and "en.wikipedia.org/wiki/" in href:
+            return href
+    return None
 
 
-def learn_more_url(question: str) -> str:
+async def search_learn_more_url(question: str) -> str | None:
     """Return the first Wikipedia Google search result URL for the question.
 
     Parameters
@@ -285,12 +384,12 @@ def learn_more_url(question: str) -> str:
 
     Returns
     -------
-    str
-        The first URL of the Wikipedia Google search result.
+    str | None
+        The first URL of the Wikipedia Google search result, None if there is none.
 
     Raises
     ------
-    HTTPError
+    ClientResponseError
         If the status code indicated failure (is in range 400-600).
 
     """
@@ -304,50 +403,88 @@ def learn_more_url(question: str) -> str:
     }
     parameters = {"q": query}
 
-    response = requests.get(url, headers=headers, params=parameters, timeout=3)
-    response.raise_for_status()  # Raise an exception for HTTP errors
-    content = response.text
+    async with http_client.session.get(
+        url,
+        headers=headers,
+        params=parameters,
+        timeout=aiohttp.ClientTimeout(total=3),
+    ) as response:
+        response.raise_for_status()  # Raise an exception for HTTP errors
+        content = await response.text()
 
-    soup = BeautifulSoup(content, "html.parser")
-    search_results = soup.find_all("a")
+    # Parsing a result page takes a while, keep it off the event loop
+    return await asyncio.to_thread(first_wikipedia_link, content)
 
-    # Find the first Wikipedia link
-    for link in search_results:
-        href: str = link.get("href")
-        if href and "en.wikipedia.org/wiki/" in href:
-            return href
 
-    # Default return
-    return "https://en.wikipedia.org"
+LEARN_MORE_DEFAULT_URL = "https://en.wikipedia.org"
+learn_more_cache: OrderedDict[str, str] = OrderedDict()
+
+
+async def learn_more_url(question: str, cache_size: int = 1024) -> str:
+    """Return a Wikipedia URL to learn more about the question.
+
+    Results are cached in memory and in the database by question text,
+    so that repeated questions resolve without searching.
+    `LEARN_MORE_DEFAULT_URL` is returned if the search failed.
+
+    Parameters
+    ----------
+    question : str
+        The question.
+    cache_size : int, optional
+        Number of URLs kept in memory (default is 1024).
+
+    Returns
+    -------
+    str
+        The URL.
+
+    Raises
+    ------
+    PyMongoError
+        If the database could not be read or written.
+
+    """
+    if url := learn_more_cache.get(question):
+        learn_more_cache.move_to_end(question)
+        return url
+
+    if not (url := await db.get_learn_more_url(question)):
+        try:
+            url = await search_learn_more_url(question)
+        except (aiohttp.ClientError, TimeoutError):
+            url = None
+        if not url:
+            return LEARN_MORE_DEFAULT_URL
+        await db.set_learn_more_url(question, url)
+
+    learn_more_cache[question] = url
+    while len(learn_more_cache) > cache_size:
+        learn_more_cache.popitem(last=False)
+    return url
 
 
 async def get_top_participants(
     interaction: discord.Interaction,
     participants: dict,
     limit: int = 3,
-) -> list:
-    """Return top 3 participants."""
+) -> list[tuple[ResolvedMember, int]]:
+    """Return top 3 participants, resolved through `member_resolver`.
+
+    Participants who left the server are left out.
+    """
     top_participants = sorted(
         participants.items(),
         key=lambda x: x[1],
         reverse=True,
     )[:limit]
 
-    top_users = []
-    for user_id, score in top_participants:
-        user = await interaction.guild.fetch_member(user_id)
-        top_users.append((user, score))
-    return top_users
+    members = await member_resolver.resolve(interaction.guild, [user_id for user_id, _ in top_participants])
+    return [(members[user_id], score) for user_id, score in top_participants if user_id in members]
 
 
-async def result_embed(
-    interaction: discord.Interaction,
-    participants: dict,
-    limit: int = 3,
-) -> discord.Embed:
-    """Return embed for quiz results with top 3."""
-    top_users = await get_top_participants(interaction, participants, limit)
-
+def result_embed(top_users: list[tuple[ResolvedMember, int]], limit: int = 3) -> discord.Embed:
+    """Return embed for quiz results with top 3, as returned by `get_top_participants`."""
     if top_users:
         result_message = ""
         for rank, (user, score) in enumerate(top_users, start=1):
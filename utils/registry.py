@@ -0,0 +1,102 @@
+import asyncio
+import contextlib
+from collections import Counter
+from collections.abc import AsyncIterator
+
+from utils.database import db
+
+
+class CommandRegistry:
+    """In-process registry of the commands running in each channel.
+
+    Lookups are answered from memory. Claims are serialized per channel by an
+    `asyncio.Lock` and persisted with a single atomic `Database.claim_command`,
+    so two fast invocations can never both start the same command. A lock
+    only lives while someone holds or waits for it.
+
+    """
+
+    def __init__(self) -> None:
+        self._active: set[tuple[str, int]] = set()
+        self._locks: dict[tuple[str, int], asyncio.Lock] = {}
+        # Number of holders and waiters of each lock
+        self._lock_users: Counter[tuple[str, int]] = Counter()
+
+    def is_active(self, command_name: str, channel_id: int) -> bool:
+        """Check if a command is active.
+
+        Parameters
+        ----------
+        command_name : str
+            Name of the command.
+        channel_id : int
+            A Discord Channel ID.
+
+        Returns
+        -------
+        bool
+            Whether or not the command is active on said channel.
+
+        """
+        return (command_name, channel_id) in self._active
+
+    async def claim(self, command_name: str, channel_id: int) -> bool:
+        """Set a command as active, unless it already is.
+
+        Parameters
+        ----------
+        command_name : str
+            Name of the command.
+        channel_id : int
+            ID of the Discord Channel where the command should be registered active.
+
+        Returns
+        -------
+        bool
+            Whether the command was claimed.
+
+        """
+        key = (command_name, channel_id)
+        if key in self._active:
+            return False
+
+        async with self._lock(key):
+            if key in self._active or not await db.claim_command(command_name, channel_id):
+                return False
+            self._active.add(key)
+            return True
+
+    async def release(self, command_name: str, channel_id: int) -> None:
+        """Set a command as inactive.
+
+        Parameters
+        ----------
+        command_name : str
+            Name of the command.
+        channel_id : int
+            ID of the Discord Channel where the command should be registered inactive.
+
+        """
+        key = (command_name, channel_id)
+        async with self._lock(key):
+            try:
+                await db.set_command_inactive(command_name, channel_id)
+            finally:
+                self._active.discard(key)
+
+    @contextlib.asynccontextmanager
+    async def _lock(self, key: tuple[str, int]) -> AsyncIterator[None]:
+        """Hold the lock of a command in a channel, dropping it once nobody holds or waits for it."""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_users[key] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
+
+
+command_registry = CommandRegistry()
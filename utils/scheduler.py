@@ -0,0 +1,255 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable
+from enum import IntEnum
+from typing import Any
+
+logger = logging.getLogger("scheduler")
+
+
+class Priority(IntEnum):
+    """Scheduling priority of a request, lower values are served first."""
+
+    INTERACTIVE = 0
+    NORMAL = 1
+    BACKGROUND = 2
+
+
+class RequestScheduler:
+    """Admission control in front of a rate limited API.
+
+    Requests wait in a priority queue and are started when a token of the
+    token bucket and a concurrency slot are both available. Identical requests
+    made while one is in flight share its result, at the highest priority any
+    of them was made at. Requests failing with one of the `retry_on` exceptions
+    empty the bucket for `penalty` seconds and are queued again.
+
+    Parameters
+    ----------
+    rate : float
+        Requests allowed per minute.
+    burst : int, optional
+        Capacity of the token bucket (default is 3).
+    concurrency : int, optional
+        Requests allowed in flight at once (default is 4).
+    retry_on : tuple[type[Exception], ...], optional
+        Exceptions signalling that the rate limit was hit (default is none).
+    retries : int, optional
+        Times a rate limited request is queued again (default is 2).
+    penalty : float, optional
+        Seconds no request is started after the rate limit was hit (default is 10).
+
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 3,
+        concurrency: int = 4,
+        retry_on: tuple[type[Exception], ...] = (),
+        retries: int = 2,
+        penalty: float = 10,
+    ) -> None:
+        self.rate = rate / 60
+        self.burst = burst
+        self.concurrency = concurrency
+        self.retry_on = retry_on
+        self.retries = retries
+        self.penalty = penalty
+
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._running = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+        self._in_flight: dict[str, asyncio.Task] = {}
+        # Priorities of the requests in flight, and order and admission future of those waiting
+        self._priorities: dict[str, Priority] = {}
+        self._queued: dict[str, tuple[int, asyncio.Future]] = {}
+
+        self.submitted = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self._waits: deque[float] = deque(maxlen=100)
+
+    async def submit(
+        self,
+        key: str,
+        request: Callable[[], Awaitable[Any]],
+        priority: Priority = Priority.NORMAL,
+    ) -> Any:  # noqa: ANN401
+        """Run a request once it is admitted, or join the identical request in flight.
+
+        Parameters
+        ----------
+        key : str
+            Identifies the request, requests with the same key are identical.
+        request : Callable[[], Awaitable[Any]]
+            Makes the request, may be called again if it is rate limited.
+        priority : Priority, optional
+            Priority of the request, raising that of the identical request
+            in flight if higher (default is `Priority.NORMAL`).
+
+        Returns
+        -------
+        Any
+            Result of the request.
+
+        """
+        self.submitted += 1
+        if (task := self._in_flight.get(key)) is None:
+            self._priorities[key] = priority
+            task = asyncio.create_task(self._run(request, priority, key))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._forget(key))
+        else:
+            self.coalesced += 1
+            self._promote(key, priority)
+        # A cancelled caller leaves the request running for the others
+        return await asyncio.shield(task)
+
+    async def run(self, request: Callable[[], Awaitable[Any]], priority: Priority = Priority.NORMAL) -> Any:  # noqa: ANN401
+        """Run a request once it is admitted, holding a slot only until it returns, e.g. to start a stream.
+
+        Parameters
+        ----------
+        request : Callable[[], Awaitable[Any]]
+            Makes the request, may be called again if it is rate limited.
+        priority : Priority, optional
+            Priority of the request (default is `Priority.NORMAL`).
+
+        Returns
+        -------
+        Any
+            Result of the request.
+
+        """
+        self.submitted += 1
+        return await self._run(request, priority)
+
+    def stats(self) -> dict[str, float]:
+        """Return the queue depth, requests in flight, counters and wait times of the last 100 requests."""
+        return {
+            "queued": len({id(future) for _, _, future in self._waiters if not future.done()}),
+            "running": self._running,
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "rate_limited": self.rate_limited,
+            "wait_avg": sum(self._waits) / len(self._waits) if self._waits else 0.0,
+            "wait_max": max(self._waits, default=0.0),
+        }
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: Priority = Priority.NORMAL, key: str | None = None) -> AsyncIterator[None]:
+        """Hold a token and a concurrency slot for the duration of the block, e.g. a streamed request.
+
+        Exceptions in `retry_on` raised in the block pause the scheduler for `penalty` seconds.
+
+        Parameters
+        ----------
+        priority : Priority, optional
+            Priority of the request (default is `Priority.NORMAL`).
+        key : str, optional
+            Identifies the request while it waits, so that its priority can be raised (default is none).
+
+        """
+        await self._acquire(priority, key)
+        try:
+            yield
+        except self.retry_on:
+            self.rate_limited += 1
+            logger.warning("Rate limited, no request is started for %s seconds.", self.penalty)
+            self._tokens = -self.penalty * self.rate
+            raise
+        finally:
+            self._release()
+
+    async def _run(
+        self,
+        request: Callable[[], Awaitable[Any]],
+        priority: Priority,
+        key: str | None = None,
+    ) -> Any:  # noqa: ANN401
+        """Make a request, queueing it again while it is rate limited, at its raised priority if it was."""
+        for attempt in itertools.count():
+            try:
+                async with self.slot(self._priorities.get(key, priority), key):
+                    return await request()
+            except self.retry_on:
+                if attempt >= self.retries:
+                    raise
+        return None
+
+    def _promote(self, key: str, priority: Priority) -> None:
+        """Raise the priority of a request in flight, queueing it again at that priority if it is waiting."""
+        if priority >= self._priorities[key]:
+            return
+        self._priorities[key] = priority
+        if (queued := self._queued.get(key)) is not None:
+            # The entry at the old priority is skipped once the request is admitted
+            order, future = queued
+            heapq.heappush(self._waiters, (priority, order, future))
+            self._dispatch()
+
+    def _forget(self, key: str) -> None:
+        """Drop a request which is no longer in flight."""
+        self._in_flight.pop(key, None)
+        self._priorities.pop(key, None)
+
+    async def _acquire(self, priority: Priority, key: str | None = None) -> None:
+        """Wait for a token and a concurrency slot, serving higher priorities first."""
+        enqueued = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        order = next(self._order)
+        heapq.heappush(self._waiters, (priority, order, future))
+        if key is not None:
+            self._queued[key] = (order, future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Admitted just before being cancelled, give the slot back
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+        finally:
+            if key is not None:
+                self._queued.pop(key, None)
+        self._waits.append(time.monotonic() - enqueued)
+
+    def _release(self) -> None:
+        """Free a concurrency slot."""
+        self._running -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Admit as many waiting requests as tokens and slots allow."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        while self._waiters and self._running < self.concurrency:
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+                continue
+            if self._tokens < 1:
+                # Come back when the next token is there
+                if self._timer is None:
+                    delay = (1 - self._tokens) / self.rate
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+                return
+            _, _, future = heapq.heappop(self._waiters)
+            self._tokens -= 1
+            self._running += 1
+            future.set_result(None)
+
+    def _on_timer(self) -> None:
+        """Dispatch once a token became available."""
+        self._timer = None
+        self._dispatch()
@@ -0,0 +1,467 @@
+import asyncio
+import bisect
+import contextlib
+import os
+import re
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Iterable
+from dataclasses import dataclass, field
+
+import discord
+from dotenv import load_dotenv
+
+from utils.members import member_resolver
+
+load_dotenv()
+
+# Budgets of a transcript, the endpoints included
+MAX_MESSAGES = int(os.getenv("TRANSCRIPT_MAX_MESSAGES", "500"))
+MAX_CHARS = int(os.getenv("TRANSCRIPT_MAX_CHARS", "30000"))
+
+USER_TAG = re.compile(r"<@?(\d+)>")
+GAP = "[...]"
+PAGE_SIZE = 100
+
+
+class TranscriptBuilder:
+    """Collect the lines of a transcript within a message and a character budget.
+
+    Parameters
+    ----------
+    max_messages : int
+        Number of lines the transcript may hold.
+    max_chars : int
+        Number of characters the transcript may hold, the line
+        which exceeds it is cut short.
+
+    Attributes
+    ----------
+    lines : list[str]
+        The lines, in the order they were added.
+    chars : int
+        Number of characters held.
+    truncated : bool
+        Whether a line was cut short.
+
+    """
+
+    def __init__(self, max_messages: int, max_chars: int) -> None:
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self.lines: list[str] = []
+        self.chars = 0
+        self.truncated = False
+
+    @property
+    def full(self) -> bool:
+        """Whether either budget is used up."""
+        return len(self.lines) >= self.max_messages or self.chars >= self.max_chars
+
+    def add(self, line: str) -> bool:
+        """Add a line, return False if the transcript is full."""
+        if self.full:
+            return False
+        cut = line[: self.max_chars - self.chars]
+        self.truncated |= len(cut) < len(line)
+        self.lines.append(cut)
+        self.chars += len(cut)
+        return True
+
+
+@dataclass
+class Transcript:
+    """The messages in between and including two messages, within budget.
+
+    Attributes
+    ----------
+    start, end
+        The oldest and newest message of the range, as `discord.PartialMessage`.
+    lines : list[str]
+        The "author: content" lines of the messages read, oldest first.
+    gap : int | None
+        Index of `lines` before which messages were skipped, None if none were.
+    truncated : bool
+        Whether a line was cut short.
+
+    """
+
+    start: discord.PartialMessage
+    end: discord.PartialMessage
+    lines: list[str]
+    gap: int | None
+    truncated: bool
+
+    @property
+    def sampled(self) -> bool:
+        """Whether messages were skipped."""
+        return self.gap is not None
+
+    def text(self) -> str:
+        """Join the transcript into one line per message, marking skipped messages with `GAP`."""
+        lines = self.lines.copy()
+        if self.gap is not None:
+            lines.insert(self.gap, GAP)
+        return "\n".join(lines)
+
+
+async def render_lines(guild: discord.Guild, messages: list[discord.Message]) -> list[str]:
+    """Render messages as "author: content" lines, resolving every tagged user at once."""
+    tagged_ids = {int(user_id) for message in messages for user_id in USER_TAG.findall(message.content)}
+    members = await member_resolver.resolve(guild, tagged_ids)
+
+    def replace_tag(match: re.Match) -> str:
+        """Replace user's ID with user's display name."""
+        user = members.get(int(match.group(1)))
+        return f"{user.display_name}" if user else match.group(0)
+
+    return [f"{message.author.display_name}: {USER_TAG.sub(replace_tag, message.content)}" for message in messages]
+
+
+@dataclass
+class ChannelTranscript:
+    """The cached lines of a channel.
+
+    Attributes
+    ----------
+    lines : dict[int, str]
+        Discord Message IDs and their rendered lines.
+    ids : list[int]
+        The keys of `lines`, sorted.
+    covered : list[tuple[int, int]]
+        Sorted, disjoint inclusive ranges of Discord Message IDs whose
+        messages are all in `lines`.
+    size : int
+        Number of characters of `lines`.
+
+    """
+
+    lines: dict[int, str] = field(default_factory=dict)
+    ids: list[int] = field(default_factory=list)
+    covered: list[tuple[int, int]] = field(default_factory=list)
+    size: int = 0
+
+    def interval(self, message_id: int) -> tuple[int, int] | None:
+        """Return the covered range containing a message ID, None if it is not covered."""
+        index = bisect.bisect_right(self.covered, (message_id, float("inf"))) - 1
+        if index >= 0 and self.covered[index][1] >= message_id:
+            return self.covered[index]
+        return None
+
+    def next_covered(self, message_id: int) -> int | None:
+        """Return the start of the first covered range after a message ID."""
+        index = bisect.bisect_right(self.covered, (message_id, float("inf")))
+        return self.covered[index][0] if index < len(self.covered) else None
+
+    def previous_covered(self, message_id: int) -> int | None:
+        """Return the end of the last covered range before a message ID."""
+        index = bisect.bisect_left(self.covered, (message_id,)) - 1
+        return self.covered[index][1] if index >= 0 else None
+
+    def between(self, low: int, high: int) -> list[int]:
+        """Return the cached message IDs from `low` to `high` inclusive, sorted."""
+        return self.ids[bisect.bisect_left(self.ids, low) : bisect.bisect_right(self.ids, high)]
+
+    def cover(self, low: int, high: int) -> None:
+        """Mark a range as fully cached, merging it with the ranges it overlaps or touches."""
+        if low > high:
+            return
+        kept = []
+        for start, end in self.covered:
+            if end + 1 < low or start > high + 1:
+                kept.append((start, end))
+            else:
+                low, high = min(low, start), max(high, end)
+        bisect.insort(kept, (low, high))
+        self.covered = kept
+
+    def uncover(self, message_id: int) -> None:
+        """Mark a message as no longer cached, splitting the range covering it."""
+        if (interval := self.interval(message_id)) is not None:
+            self.covered.remove(interval)
+            for low, high in ((interval[0], message_id - 1), (message_id + 1, interval[1])):
+                if low <= high:
+                    bisect.insort(self.covered, (low, high))
+
+    def add(self, message_id: int, line: str) -> int:
+        """Cache a line, return the change in size."""
+        previous = self.lines.get(message_id)
+        if previous is None:
+            bisect.insort(self.ids, message_id)
+        self.lines[message_id] = line
+        delta = len(line) - len(previous or "")
+        self.size += delta
+        return delta
+
+    def remove(self, message_id: int) -> int:
+        """Drop a line, return the change in size."""
+        if (line := self.lines.pop(message_id, None)) is None:
+            return 0
+        self.ids.pop(bisect.bisect_left(self.ids, message_id))
+        self.size -= len(line)
+        return -len(line)
+
+
+class TranscriptCache:
+    """Per-channel cache of rendered transcript lines, keyed by message ID.
+
+    Every channel remembers which ranges of message IDs it holds in full, so
+    reading a range only fetches the messages in between those from Discord.
+    Edited messages are dropped along with their coverage, deleted ones are
+    just dropped. Channels are evicted least recently used first once the
+    lines of all channels exceed `max_chars`.
+
+    Parameters
+    ----------
+    max_chars : int, optional
+        Number of characters cached across all channels (default is 5000000).
+
+    Attributes
+    ----------
+    size : int
+        Number of characters cached.
+    fetched, served : int
+        Number of lines fetched from Discord and served from the cache.
+
+    """
+
+    def __init__(self, max_chars: int = 5_000_000) -> None:
+        self.max_chars = max_chars
+        self.size = 0
+        self.fetched = 0
+        self.served = 0
+        self._channels: OrderedDict[int, ChannelTranscript] = OrderedDict()
+
+    async def fetch(self, channel: discord.abc.GuildChannel, message_ids: Iterable[int]) -> None:
+        """Cache the messages which are not cached yet, fetched concurrently.
+
+        Raises
+        ------
+        discord.NotFound
+            If a message does not exist.
+
+        """
+        transcript = self._channel(channel.id)
+        missing = [message_id for message_id in message_ids if message_id not in transcript.lines]
+        messages = await asyncio.gather(*(channel.fetch_message(message_id) for message_id in missing))
+        await self._store(channel, transcript, messages)
+        for message in messages:
+            transcript.cover(message.id, message.id)
+
+    async def read(
+        self,
+        channel: discord.abc.GuildChannel,
+        low: int,
+        high: int,
+        *,
+        oldest_first: bool = True,
+    ) -> AsyncIterator[tuple[int, str]]:
+        """Read the lines of the messages from `low` to `high` inclusive, fetching the uncached ones a page at a time.
+
+        Parameters
+        ----------
+        channel
+            The `discord.abc.GuildChannel` the messages were sent in.
+        low, high : int
+            Discord Message IDs bounding the range.
+        oldest_first : bool, optional
+            Whether to read forwards from `low` rather than backwards from `high` (default is True).
+
+        Yields
+        ------
+        tuple[int, str]
+            Discord Message IDs and their lines.
+
+        """
+        transcript = self._channel(channel.id)
+        # Every message up to (or from) the cursor has been read
+        cursor = low - 1 if oldest_first else high + 1
+        while cursor < high if oldest_first else cursor > low:
+            position = cursor + 1 if oldest_first else cursor - 1
+            if (interval := transcript.interval(position)) is not None:
+                if oldest_first:
+                    cursor = min(interval[1], high)
+                    ids = transcript.between(position, cursor)
+                else:
+                    cursor = max(interval[0], low)
+                    ids = transcript.between(cursor, position)[::-1]
+                for message_id in ids:
+                    self.served += 1
+                    yield message_id, transcript.lines[message_id]
+                continue
+
+            # Fetch the gap up to the next covered range
+            if oldest_first:
+                bound = min(transcript.next_covered(position) or high + 1, high + 1)
+            else:
+                bound = max(transcript.previous_covered(position) or low - 1, low - 1)
+            gap = self._fetch(channel, transcript, cursor, bound, oldest_first=oldest_first)
+            async with contextlib.aclosing(gap) as lines:
+                async for message_id, line in lines:
+                    yield message_id, line
+            cursor = bound - 1 if oldest_first else bound + 1
+
+    async def _fetch(
+        self,
+        channel: discord.abc.GuildChannel,
+        transcript: ChannelTranscript,
+        cursor: int,
+        bound: int,
+        *,
+        oldest_first: bool,
+    ) -> AsyncIterator[tuple[int, str]]:
+        """Fetch the messages in between two message IDs a page at a time, covering the range as it goes."""
+        after, before = (cursor, bound) if oldest_first else (bound, cursor)
+        history = channel.history(
+            after=discord.Object(after),
+            before=discord.Object(before),
+            limit=None,
+            oldest_first=oldest_first,
+        )
+        async for page in pages(history):
+            lines = await self._store(channel, transcript, page)
+            if oldest_first:
+                transcript.cover(cursor + 1, page[-1].id)
+            else:
+                transcript.cover(page[-1].id, cursor - 1)
+            cursor = page[-1].id
+            for message, line in zip(page, lines, strict=True):
+                yield message.id, line
+
+        # The rest of the range has no messages
+        if oldest_first:
+            transcript.cover(cursor + 1, bound - 1)
+        else:
+            transcript.cover(bound + 1, cursor - 1)
+
+    def invalidate(self, channel_id: int, message_ids: Iterable[int], *, deleted: bool = False) -> None:
+        """Drop edited or deleted messages.
+
+        Parameters
+        ----------
+        channel_id : int
+            A Discord Channel ID.
+        message_ids : Iterable[int]
+            Discord Message IDs.
+        deleted : bool, optional
+            Whether the messages were deleted, which keeps their ranges
+            covered since they are gone from the channel too (default is False).
+
+        """
+        if (transcript := self._channels.get(channel_id)) is None:
+            return
+        for message_id in message_ids:
+            self.size += transcript.remove(message_id)
+            if not deleted:
+                transcript.uncover(message_id)
+
+    def stats(self) -> dict[str, int]:
+        """Return the cache's fetched and served counters, the number of cached channels and their size."""
+        return {"fetched": self.fetched, "served": self.served, "channels": len(self._channels), "size": self.size}
+
+    def _channel(self, channel_id: int) -> ChannelTranscript:
+        """Return the cached lines of a channel, creating them if needed."""
+        if (transcript := self._channels.get(channel_id)) is None:
+            transcript = self._channels[channel_id] = ChannelTranscript()
+        self._channels.move_to_end(channel_id)
+        return transcript
+
+    async def _store(
+        self,
+        channel: discord.abc.GuildChannel,
+        transcript: ChannelTranscript,
+        messages: list[discord.Message],
+    ) -> list[str]:
+        """Render and cache messages, evicting the least recently used channels if full."""
+        lines = await render_lines(channel.guild, messages)
+        # A channel evicted while it was being read is no longer accounted for
+        registered = self._channels.get(channel.id) is transcript
+        for message, line in zip(messages, lines, strict=True):
+            delta = transcript.add(message.id, line)
+            if registered:
+                self.size += delta
+        self.fetched += len(messages)
+
+        while self.size > self.max_chars and len(self._channels) > 1:
+            _, evicted = self._channels.popitem(last=False)
+            self.size -= evicted.size
+        return lines
+
+
+async def pages(messages: AsyncIterator[discord.Message]) -> AsyncIterator[list[discord.Message]]:
+    """Group messages into pages of `PAGE_SIZE`, the size Discord returns them in."""
+    page = []
+    async for message in messages:
+        page.append(message)
+        if len(page) == PAGE_SIZE:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+transcript_cache = TranscriptCache()
+
+
+async def read_history(
+    channel: discord.abc.GuildChannel,
+    start_id: int,
+    end_id: int,
+    max_messages: int = MAX_MESSAGES,
+    max_chars: int = MAX_CHARS,
+) -> Transcript:
+    """Read the messages in between and including two messages, within budget.
+
+    Messages are read through `transcript_cache`, so only those not read
+    before are fetched, the endpoints at once and the rest a page at a time.
+    Half of the budget goes to the oldest messages. If those do not reach the
+    end, the rest goes to the newest messages and the ones in between are
+    skipped.
+
+    Parameters
+    ----------
+    channel
+        The `discord.abc.GuildChannel` the messages were sent in.
+    start_id, end_id : int
+        Discord Message IDs of the endpoints, in either order.
+    max_messages : int, optional
+        Message budget (default is `MAX_MESSAGES`).
+    max_chars : int, optional
+        Character budget (default is `MAX_CHARS`).
+
+    Returns
+    -------
+    Transcript
+        The messages read.
+
+    Raises
+    ------
+    discord.NotFound
+        If either endpoint does not exist.
+
+    """
+    start_id, end_id = sorted((start_id, end_id))
+    await transcript_cache.fetch(channel, {start_id, end_id})
+
+    head = TranscriptBuilder(max(max_messages // 2, 1), max_chars // 2)
+    last = start_id - 1
+    async with contextlib.aclosing(transcript_cache.read(channel, start_id, end_id - 1)) as lines:
+        async for message_id, line in lines:
+            if not head.add(line):
+                break
+            last = message_id
+
+    # Fill the rest of the budget backwards from the end
+    tail = TranscriptBuilder(max(max_messages - len(head.lines), 1), max_chars - head.chars)
+    gap = None
+    async with contextlib.aclosing(transcript_cache.read(channel, last + 1, end_id, oldest_first=False)) as lines:
+        async for _, line in lines:
+            if not tail.add(line):
+                gap = len(head.lines)
+                break
+    return Transcript(
+        channel.get_partial_message(start_id),
+        channel.get_partial_message(end_id),
+        head.lines + tail.lines[::-1],
+        gap,
+        head.truncated or tail.truncated,
+    )
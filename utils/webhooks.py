@@ -0,0 +1,110 @@
+import asyncio
+from collections.abc import AsyncIterable
+from dataclasses import dataclass
+
+import discord
+
+WEBHOOK_NAME = "Discussion"
+
+
+@dataclass(frozen=True)
+class WebhookPayload:
+    """A message to send through a webhook, ready to go.
+
+    Attributes
+    ----------
+    content : str
+        The message.
+    username : str
+        Name to send the message as.
+    avatar_url : str
+        Avatar to send the message with.
+    delay : float
+        Seconds to wait before sending the message.
+
+    """
+
+    content: str
+    username: str
+    avatar_url: str
+    delay: float = 0
+
+    @classmethod
+    def from_user(cls, user: discord.abc.User, content: str, delay: float = 0) -> "WebhookPayload":
+        """Prepare a message sent as a user."""
+        return cls(content, user.display_name, (user.avatar or user.default_avatar).url, delay)
+
+
+class WebhookRegistry:
+    """Cache of one usable webhook per channel.
+
+    A channel's webhooks are listed once, taking the first the bot has the
+    token of or creating one if there is none. Concurrent lookups of the same
+    channel share one resolution. Entries are dropped through `invalidate`,
+    on the webhooks update gateway event or when a cached webhook is gone.
+
+    """
+
+    def __init__(self) -> None:
+        self._webhooks: dict[int, discord.Webhook] = {}
+        self._pending: dict[int, asyncio.Task] = {}
+
+    async def get(self, channel: discord.TextChannel) -> discord.Webhook:
+        """Return a webhook of the channel that the bot can send through.
+
+        Raises
+        ------
+        discord.Forbidden
+            If the bot may not manage the channel's webhooks.
+
+        """
+        if (webhook := self._webhooks.get(channel.id)) is not None:
+            return webhook
+
+        if channel.id not in self._pending:
+            self._pending[channel.id] = asyncio.create_task(self._resolve(channel))
+        try:
+            webhook = await asyncio.shield(self._pending[channel.id])
+        finally:
+            self._pending.pop(channel.id, None)
+        self._webhooks[channel.id] = webhook
+        return webhook
+
+    def invalidate(self, channel_id: int) -> None:
+        """Drop the cached webhook of a channel."""
+        self._webhooks.pop(channel_id, None)
+
+    async def _resolve(self, channel: discord.TextChannel) -> discord.Webhook:
+        """Find a webhook the bot has the token of, or create one."""
+        for webhook in await channel.webhooks():
+            if webhook.token:
+                return webhook
+        return await channel.create_webhook(name=WEBHOOK_NAME)
+
+
+webhook_registry = WebhookRegistry()
+
+
+async def deliver(channel: discord.TextChannel, payloads: AsyncIterable[WebhookPayload]) -> None:
+    """Send prepared messages through the channel's webhook, one request per message.
+
+    The webhook is resolved while the first message is still being prepared,
+    and again once if it was deleted in the meantime.
+
+    Parameters
+    ----------
+    channel
+        The `discord.TextChannel` to send the messages in.
+    payloads : AsyncIterable[WebhookPayload]
+        The messages, in order, possibly still being prepared.
+
+    """
+    webhook = await webhook_registry.get(channel)
+    async for payload in payloads:
+        await asyncio.sleep(payload.delay)
+        try:
+            await webhook.send(content=payload.content, username=payload.username, avatar_url=payload.avatar_url)
+        except discord.NotFound:
+            webhook_registry.invalidate(channel.id)
+            webhook = await webhook_registry.get(channel)
+            await webhook.send(content=payload.content, username=payload.username, avatar_url=payload.avatar_url)
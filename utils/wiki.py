@@ -1,126 +1,339 @@
-import os
+import asyncio
+import logging
 import random
 import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
 
-import google.generativeai as genai
-import requests
+import aiohttp
 import wikipedia
-from bs4 import BeautifulSoup
-from dotenv import load_dotenv
 
-load_dotenv()
-GEMINI_KEY = os.getenv("GOOGLE_API_KEY")
-WIKI_REQUEST = "http://en.wikipedia.org/w/api.php?action=query&prop=pageimages&format=json&piprop=original&titles="
+from utils.http import http_client
+from utils.scheduler import Priority
 
+logger = logging.getLogger("wiki")
 
-genai.configure(api_key=GEMINI_KEY)
-model = genai.GenerativeModel("gemini-1.5-flash")
+WIKI_API = "https://en.wikipedia.org/w/api.php"
+WIKI_HEADERS = {"User-Agent": "QuizzlyBear/0.1 (https://github.com/13acts/Code-Jam-2024)"}
 
+# Sentences falsified per Gemini request, and pool size below which the pool is refilled
+FALSIFY_BATCH_SIZE = 5
+FALSIFIED_POOL_SIZE = 3
 
-def get_wiki_facts(prompt: str, number: int = 5) -> list:
-    """Fetch factual one liners from Wikipedia.
+
+class TooFewSentencesError(Exception):
+    """The article's summary has fewer sentences than statements were asked for."""
+
+
+def normalize_title(title: str) -> str:
+    """Normalize an article title the way Wikipedia does, e.g. "python_ (language)" to "Python (language)"."""
+    title = " ".join(title.replace("_", " ").split())
+    return title[:1].upper() + title[1:]
+
+
+@dataclass
+class WikiSummary:
+    """A cached article summary.
+
+    Attributes
+    ----------
+    title : str
+        Title of the article, after redirects.
+    revision : int
+        ID of the article revision the summary was taken from.
+    sentences : list[str]
+        The summary, as split by `split_into_sentences`.
+    image : str | None
+        URL of the article's original page image, if it has one.
+    expires_at : float
+        Monotonic time after which the revision must be checked again.
+    falsified : dict[str, str]
+        Pool of sentences and their false versions, not used in a game yet.
+    refill : asyncio.Task | None
+        The running `refill_falsified` task, if any.
+    refill_batch : list[str]
+        Sentences the last refill falsifies.
+    refill_priority : Priority
+        Scheduling priority of the last refill.
+
+    """
+
+    title: str
+    revision: int
+    sentences: list[str]
+    image: str | None
+    expires_at: float
+    falsified: dict[str, str] = field(default_factory=dict)
+    refill: asyncio.Task | None = None
+    refill_batch: list[str] = field(default_factory=list)
+    refill_priority: Priority = Priority.BACKGROUND
+
+
+async def fetch_page(title: str) -> dict:
+    """Fetch the plain text summary, page image and latest revision ID of an article in one query.
 
     Parameters
     ----------
-    prompt : str
-        Name of the article to fetch facts from.
-    number : int, optional
-        Number of facts (default is 5).
+    title : str
+        Exact title of the article, redirects are followed.
 
     Returns
     -------
-    list
-        *number* amount of facts based on *prompt*.
+    dict
+        The MediaWiki page, with keys title, lastrevid, extract
+        and original (only if the article has a page image).
+
+    Raises
+    ------
+    DisambiguationError
+        If the title refers to a disambiguation page.
+    PageError
+        If there is no article with that title.
+
+    """
+    params = {
+        "action": "query",
+        "format": "json",
+        "formatversion": 2,
+        "prop": "extracts|info|pageimages|pageprops",
+        "ppprop": "disambiguation",
+        "piprop": "original",
+        "exintro": 1,
+        "explaintext": 1,
+        "redirects": 1,
+        "titles": title,
+    }
+    async with http_client.session.get(
+        WIKI_API,
+        params=params,
+        headers=WIKI_HEADERS,
+        timeout=aiohttp.ClientTimeout(total=5),
+    ) as response:
+        response.raise_for_status()
+        page = (await response.json())["query"]["pages"][0]
+
+    if page.get("missing") or page.get("invalid"):
+        raise wikipedia.PageError(None, title)
+    if "disambiguation" in page.get("pageprops", {}):
+        raise wikipedia.DisambiguationError(page["title"], [])
+    return page
+
+
+class WikiSummaryCache:
+    """Cache of article summaries, sentences and images, keyed by normalized title and revision.
+
+    An entry is served from memory until it expires. An expired entry is only
+    split again if the article has a new revision since it was cached.
+
+    Parameters
+    ----------
+    ttl : float, optional
+        Seconds an entry is served without checking its revision (default is 1 hour).
+    max_items : int, optional
+        Number of cached articles, least recently used first out (default is 512).
+
+    """
+
+    def __init__(self, ttl: float = 60 * 60, max_items: int = 512) -> None:
+        self.ttl = ttl
+        self.max_items = max_items
+        self._entries: OrderedDict[str, WikiSummary] = OrderedDict()
+
+    async def get(self, title: str) -> WikiSummary:
+        """Return the summary of an article.
+
+        Raises
+        ------
+        DisambiguationError
+            If the title refers to a disambiguation page.
+        PageError
+            If there is no article with that title.
 
+        """
+        key = normalize_title(title)
+        now = time.monotonic()
+        entry = self._entries.get(key)
+
+        if entry is None or entry.expires_at <= now:
+            page = await fetch_page(title)
+            if entry is not None and entry.revision == page["lastrevid"]:
+                entry.expires_at = now + self.ttl
+            else:
+                sentences = split_into_sentences(page["extract"])
+                image = page.get("original", {}).get("source")
+                entry = WikiSummary(page["title"], page["lastrevid"], sentences, image, now + self.ttl)
+
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+        return entry
+
+
+wiki_summaries = WikiSummaryCache()
+
+
+async def falsify_sentences(summary: WikiSummary, batch: list[str], priority: Priority) -> None:
+    """Add a batch of the summary's sentences to its pool of false statements, in one request."""
+    # Imported here so that the rest of the module does not need the Gemini and database settings
+    from utils.gemini import gemini_client
+
+    if batch:
+        summary.falsified.update(await gemini_client.falsify_facts(batch, priority))
+
+
+def refill_falsified(summary: WikiSummary, priority: Priority = Priority.BACKGROUND) -> asyncio.Task:
+    """Start refilling the summary's pool of false statements.
+
+    If it is already being refilled at a lower priority, the refill is joined
+    at `priority`, which the scheduler raises the shared request to.
     """
-    return random.sample(split_into_sentences(wikipedia.summary(prompt, auto_suggest=False)), k=number)
+    if summary.refill is None or summary.refill.done():
+        candidates = [sentence for sentence in summary.sentences if sentence not in summary.falsified]
+        summary.refill_batch = random.sample(candidates, k=min(FALSIFY_BATCH_SIZE, len(candidates)))
+    elif priority >= summary.refill_priority:
+        return summary.refill
+
+    summary.refill = asyncio.create_task(falsify_sentences(summary, summary.refill_batch, priority))
+    summary.refill.add_done_callback(log_refill_error)
+    summary.refill_priority = priority
+    return summary.refill
+
 
+def log_refill_error(task: asyncio.Task) -> None:
+    """Log the exception a pool refill failed with, if any."""
+    if not task.cancelled() and (error := task.exception()):
+        logger.error("Could not falsify sentences.", exc_info=error)
 
-def create_false_statement(fact: str) -> str:
-    """Get a false fact based on a true fact.
+
+async def get_wiki_statements(
+    prompt: str,
+    number: int = 5,
+    priority: Priority = Priority.INTERACTIVE,
+) -> tuple[list[str], int, str]:
+    """Fetch one liners from Wikipedia, one of which is false.
+
+    The false statement is taken from the article's pool of pre-falsified
+    sentences, which is refilled in the background as it runs low.
 
     Parameters
     ----------
-    fact : str
-        The true fact.
+    prompt : str
+        Name of the article to fetch facts from.
+    number : int, optional
+        Number of statements (default is 5).
+    priority : Priority, optional
+        Scheduling priority of the request falsifying sentences if the pool
+        is empty (default is `Priority.INTERACTIVE`).
 
     Returns
     -------
-    str
-        Falsified version of the fact.
+    tuple[list[str], int, str]
+        *number* amount of statements based on *prompt*, the index of
+        the false statement and the fact it was made from.
+
+    Raises
+    ------
+    DisambiguationError
+        If the prompt refers to a disambiguation page.
+    PageError
+        If there is no article with that title.
+    TooFewSentencesError
+        If the summary has fewer than *number* sentences.
+    GeminiError
+        If no false statement could be created.
 
     """
-    prompt = f"Create a false fact for a True False quiz based on this fact: {fact} in one line. Answer directly and only the false statement."  # noqa: E501
-    response = model.generate_content(prompt)
-    return response.text
+    from utils.gemini import GeminiError
+
+    summary = await wiki_summaries.get(prompt)
+    if len(summary.sentences) < number:
+        msg = f"The summary of {summary.title} has fewer than {number} sentences."
+        raise TooFewSentencesError(msg)
+    if not summary.falsified:
+        await asyncio.shield(refill_falsified(summary, priority))
+    if not summary.falsified:
+        msg = f"No false statement could be created about {summary.title}."
+        raise GeminiError(msg)
+
+    correction = random.choice(list(summary.falsified))  # noqa: S311
+    false_statement = summary.falsified.pop(correction)
+    statements = random.sample([sentence for sentence in summary.sentences if sentence != correction], k=number - 1)
+    false_index = random.randint(0, number - 1)  # noqa: S311
+    statements.insert(false_index, false_statement)
 
+    if len(summary.falsified) < FALSIFIED_POOL_SIZE:
+        refill_falsified(summary)
+    return statements, false_index, correction
 
-def get_wiki_image(search_term: str) -> str | bool:
-    """Return featured image URL of search.
 
-    This function may fail because of many reasons, e.g.
-    if the connection failed, or if the parsing did not
-    go as expected. False is returned to indicate failure.
+async def get_wiki_image(search_term: str) -> str | bool:
+    """Return featured image URL of an article.
+
+    The image comes with the article's cached summary, so right after
+    `get_wiki_statements` this does not make any request.
 
     Parameters
     ----------
     search_term : str
-        The search term to use for the Wiki image search.
+        Title of the article.
 
     Returns
     -------
     str
         URL of the image.
     bool
-        Returns False if any error occured.
+        Returns False if the article has no image or could not be fetched.
 
     """
     try:
-        wikipedia.set_lang("en")
-        result = wikipedia.search(search_term, results=1)
-        if not result:
-            return False
-
-        wkpage = wikipedia.WikipediaPage(title=result[0])
-        response = requests.get(wkpage.url, timeout=3)
-        response.raise_for_status()
-
-        soup = BeautifulSoup(response.text, "html.parser")
-        infobox = soup.find("table", {"class": "infobox"})
-        if not infobox:
-            return False
-
-        image_tag = infobox.find("img", class_="mw-file-element")
-        if not image_tag:
-            return False
-
-        image_url = image_tag["src"]
-        if image_url.startswith("//"):
-            image_url = "https:" + image_url
-
-        return image_url  # noqa: TRY300
+        summary = await wiki_summaries.get(search_term)
     except Exception:
         return False
+    return summary.image or False
 
 
 # Credits to https://stackoverflow.com/questions/4576077/how-can-i-split-a-text-into-sentences
-alphabets = "([A-Za-z])"
-prefixes = "(Mr|St|Mrs|Ms|Dr)[.]"
-suffixes = "(Inc|Ltd|Jr|Sr|Co)"
-starters = (
-    r"(Mr|Mrs|Ms|Dr|Prof|Capt|Cpt|Lt|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s|This\s|Wherever)"
+# The substitution passes of that answer are folded into a single scan. Every token starts with
+# the punctuation mark it is about, so that the scan skips straight from one mark to the next,
+# and alternatives are ordered the way the passes used to run. Each one ends in an empty group
+# naming it.
+STARTERS = (
+    r"(?:Mr|Mrs|Ms|Dr|Prof|Capt|Cpt|Lt|He\s|She\s|It\s|They\s|Their\s|Our\s|We\s|But\s|However\s|That\s"
+    r"|This\s|Wherever)"
 )
-acronyms = "([A-Z][.][A-Z][.](?:[A-Z][.])?)"
-websites = "[.](com|net|org|io|gov|edu|me)"
-digits = "([0-9])"
-multiple_dots = r"\.{2,}"
-
+WEBSITES = "(?:com|net|org|io|gov|edu|me)"
+SENTENCE_TOKEN = re.compile(
+    rf"""
+    \.(?:
+        (?:(?<=Mr\.|St\.|Ms\.|Dr\.)|(?<=Mrs\.))(?P<prefix>)                                         # "Dr."
+      | (?<=Ph\.)D\.(?!{WEBSITES}|\.(?!{WEBSITES}))(?P<phd>)                                        # "Ph.D."
+      | (?<=[A-Za-z]\.)(?!{WEBSITES})[A-Za-z]\.(?!{WEBSITES})
+        (?:[A-Za-z]\.(?!{WEBSITES}))?(?!\.(?!{WEBSITES}))(?P<abbreviation>)                         # "e.g."
+      | (?:(?<=\ Inc\.|\ Ltd\.)|(?<=\ Jr\.|\ Sr\.|\ Co\.))
+        (?:(?=\ (?P<starter>{STARTERS}))(?P<suffix_stop>)|(?!\.(?!{WEBSITES}))(?P<suffix>))         # "Inc. He", "Inc."
+      | (?<=\s[A-Za-z]\.)(?=\ )(?P<initial>)                                                        # " J. "
+      | (?<=\ [A-Za-z]\.)(?!\.(?!{WEBSITES}))(?P<letter>)                                           # " J."
+      | (?<=[0-9]\.)(?=[0-9])(?P<number>)                                                           # "1.5"
+      | (?:\.(?!{WEBSITES}))+(?P<ellipsis>)                                                         # "..."
+      | (?={WEBSITES})(?P<website>)                                                                 # ".com"
+      | (?:”"?|")(?P<quoted>)                                                                       # '."'
+      | (?P<stop>)                                                                                  # "."
+    )
+  | \?(?:!?(?:\.”?)?"(?P<quoted_question>)|(?P<question>))                                          # '?"', "?"
+  | !(?:(?:\.”?)?"(?P<quoted_exclamation>)|(?P<exclamation>))                                       # '!"', "!"
+    """,
+    re.VERBOSE,
+)
+ACRONYM_END = re.compile(rf"(?<=[A-Z]\.[A-Z]\.)(?<!Ph\.D\.[A-Z]\.)\ {STARTERS}")
+SENTENCE_ENDS = frozenset(("ellipsis", "stop", "question", "exclamation"))
+QUOTED = frozenset(("quoted", "quoted_question", "quoted_exclamation"))
+MARKS = re.compile(r"[^.?!]*[.?!]")
 
-def split_into_sentences(text: str) -> list[str]:
-    r"""Split the text into sentences.
 
-    If the text contains substrings "\<prd\>" or "\<stop\>", they would lead
-    to incorrect splitting because they are used as markers for splitting.
+def split_into_sentences(text: str) -> list[str]:  # noqa: C901
+    """Split the text into sentences.
 
     Parameters
     ----------
@@ -133,39 +346,56 @@ def split_into_sentences(text: str) -> list[str]:
         list of sentences
 
     """
-    text = " " + text + "  "
-    text = text.replace("\n", " ")
-    text = re.sub(prefixes, "\\1<prd>", text)
-    text = re.sub(websites, "<prd>\\1", text)
-    text = re.sub(digits + "[.]" + digits, "\\1<prd>\\2", text)
-    text = re.sub(multiple_dots, lambda match: "<prd>" * len(match.group(0)) + "<stop>", text)
-    if "Ph.D" in text:
-        text = text.replace("Ph.D.", "Ph<prd>D<prd>")
-    text = re.sub(r"\s" + alphabets + "[.] ", " \\1<prd> ", text)
-    text = re.sub(acronyms + " " + starters, "\\1<stop> \\2", text)
-    text = re.sub(
-        alphabets + "[.]" + alphabets + "[.]" + alphabets + "[.]",
-        "\\1<prd>\\2<prd>\\3<prd>",
-        text,
-    )
-    text = re.sub(alphabets + "[.]" + alphabets + "[.]", "\\1<prd>\\2<prd>", text)
-    text = re.sub(" " + suffixes + "[.] " + starters, " \\1<stop> \\2", text)
-    text = re.sub(" " + suffixes + "[.]", " \\1<prd>", text)
-    text = re.sub(" " + alphabets + "[.]", " \\1<prd>", text)
-    if "”" in text:
-        text = text.replace(".”", "”.")
-    if '"' in text:
-        text = text.replace('."', '".')
-    if "!" in text:
-        text = text.replace('!"', '"!')
-    if "?" in text:
-        text = text.replace('?"', '"?')
-    text = text.replace(".", ".<stop>")
-    text = text.replace("?", "?<stop>")
-    text = text.replace("!", "!<stop>")
-    text = text.replace("<prd>", ".")
-    sentences = text.split("<stop>")
-    sentences = [s.strip() for s in sentences]
-    if sentences and not sentences[-1]:
-        sentences = sentences[:-1]
+    text = " " + text.replace("\n", " ") + "  "
+    sentences = []
+    sentence = []
+    start = 0
+    # End of the digit after the last number, and of the starter after the last suffix ending a sentence
+    number_end = starter_end = 0
+    for match in SENTENCE_TOKEN.finditer(text):
+        position = match.start()
+        sentence.append(text[start:position])
+        start = match.end()
+        kind = match.lastgroup
+        if kind == "number" and position == number_end:
+            # Its first digit is the last digit of the previous number ("1.2.3")
+            kind = "stop"
+        elif kind == "suffix_stop" and text.rfind(" ", 0, position) < starter_end:
+            # Its space was taken by the starter of the previous one ("Inc. Ltd.")
+            kind = "suffix"
+
+        if kind == "number":
+            number_end = position + 2
+            sentence.append(".")
+        elif kind == "suffix_stop":
+            # The period after a suffix ending a sentence is dropped
+            sentences.append("".join(sentence).strip())
+            sentence = []
+            starter_end = match.end("starter")
+        elif kind == "initial" and text[position - 2] != " ":
+            # The whitespace before an initial is normalized to a space
+            sentence[-1] = sentence[-1][:-2] + " " + sentence[-1][-1]
+            sentence.append(".")
+        elif kind in QUOTED:
+            # Closing quotes are moved before the marks, each mark ends a sentence
+            marks = match[0].replace(".”", "”.").replace('."', '".').replace('!"', '"!').replace('?"', '"?')
+            first, *others = MARKS.findall(marks)
+            sentence.append(first)
+            sentences.append("".join(sentence).strip())
+            sentences.extend(others)
+            sentence = []
+        else:
+            sentence.append(match[0])
+            if kind in SENTENCE_ENDS:
+                sentences.append("".join(sentence).strip())
+                sentence = []
+
+        # An acronym followed by a sentence starter ends a sentence ("U.S. He"), even after a period
+        if kind in ("abbreviation", "stop") and text[start - 2].isupper() and ACRONYM_END.match(text, start):
+            sentences.append("".join(sentence).strip())
+            sentence = []
+
+    sentence.append(text[start:])
+    if last := "".join(sentence).strip():
+        sentences.append(last)
     return sentences